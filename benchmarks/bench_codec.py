@@ -0,0 +1,125 @@
+"""
+Verification and benchmarks of the Local Server Message codec backends.
+
+Every message the client sends is encoded by both backends and checked to be byte-identical, and replies are checked
+to decode to the same fields. Then each backend is timed, and the memory it allocates per message is measured.
+
+Usage:
+    python -m benchmarks.bench_codec [--number 20000]
+
+Exits with a non-zero status if the backends disagree on any message.
+"""
+import argparse
+import sys
+import timeit
+import tracemalloc
+
+from robovac import LocalServerInfo_pb2, codec
+from robovac.robovac import _COMMAND_PAYLOADS
+
+LOCAL_CODES = ('ABCDEFGHIJKLMNOP', '', 'SIMULATED0000000', 'ünïcödé')
+MAGIC_NUMBERS = (None, 0, 1, 127, 128, 300, 2999999, 2 ** 31, 2 ** 32 - 1)
+STATUS_PAYLOAD = bytes([0xA5, 2, 0, 0, 0, 0, 6, 0, 1, 0, 80, 1, 0, 0, 0xFA])
+
+
+def _messages_sent():
+    """ Keyword arguments for every message the client sends. """
+    for local_code in LOCAL_CODES:
+        for magic_number in MAGIC_NUMBERS:
+            yield dict(magic_num=magic_number, localcode=local_code, ping_type=codec.PING_REQUEST)
+            yield dict(magic_num=magic_number, localcode=local_code, user_data_type=codec.GET_DEVICE_STATUS_DATA)
+            for payload in _COMMAND_PAYLOADS.values():
+                yield dict(magic_num=magic_number, localcode=local_code,
+                           user_data_type=codec.SEND_USER_DATA_TO_DEVICE, usr_data=payload)
+
+
+def _replies():
+    """ Serialized messages as sent by a RoboVac, including fields the client doesn't use. """
+    message = LocalServerInfo_pb2.LocalServerMessage()
+    message.magic_num = 2999999
+    message.localcode = 'ABCDEFGHIJKLMNOP'
+    message.a.type = codec.PING_RESPONSE
+    yield message.SerializeToString()
+
+    for user_data_type in (codec.GET_DEVICE_STATUS_DATA, codec.SEND_STATUS_DATA_TO_APP):
+        message = LocalServerInfo_pb2.LocalServerMessage()
+        message.magic_num = 123456
+        message.localcode = 'ABCDEFGHIJKLMNOP'
+        message.c.type = user_data_type
+        message.c.usr_data = STATUS_PAYLOAD
+        yield message.SerializeToString()
+
+    message = LocalServerInfo_pb2.LocalServerMessage()
+    message.magic_num = 7
+    message.d.data = b'keycode'
+    yield message.SerializeToString()
+
+    # A payload field repeated on the wire is merged, and an empty message decodes to the defaults
+    yield b'\x08\x01*\x02\x08\x01*\x05\x12\x03abc'
+    yield b''
+
+
+def _fields(message):
+    playload = message.WhichOneof('playload')
+    return (message.magic_num, message.localcode, playload, message.a.type, message.c.type, bytes(message.c.usr_data))
+
+
+def verify() -> list:
+    """ Messages on which the backends disagree. """
+    mismatches = []
+
+    for fields in _messages_sent():
+        expected = codec.ProtobufCodec.encode(**fields)
+        actual = codec.PurePythonCodec.encode(**fields)
+        if actual != expected:
+            mismatches.append(f'encode {fields}: {actual!r} != {expected!r}')
+
+    for data in _replies():
+        expected = _fields(codec.ProtobufCodec.decode(data))
+        actual = _fields(codec.PurePythonCodec.decode(data))
+        if actual != expected:
+            mismatches.append(f'decode {data!r}: {actual!r} != {expected!r}')
+
+    return mismatches
+
+
+def peak_allocated_bytes(function, number=1000) -> int:
+    """ The most memory allocated at once during a call, including memory freed again before it returns. """
+    function()
+    tracemalloc.start()
+    try:
+        for _ in range(number):
+            function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify and benchmark the codec backends.')
+    parser.add_argument('--number', type=int, default=20000, help='Operations per timing run')
+    args = parser.parse_args()
+
+    mismatches = verify()
+    for mismatch in mismatches:
+        print(f'MISMATCH {mismatch}')
+    if mismatches:
+        sys.exit(1)
+    print('Backends produce identical messages')
+
+    command = dict(magic_num=123456, localcode='ABCDEFGHIJKLMNOP',
+                   user_data_type=codec.SEND_USER_DATA_TO_DEVICE, usr_data=b'\xa5\xe1\x02\xe3\xfa')
+    reply = list(_replies())[1]
+
+    for backend in (codec.ProtobufCodec, codec.PurePythonCodec):
+        benchmarks = [
+            ('encode command', lambda: backend.encode(**command)),
+            ('decode status reply', lambda: backend.decode(reply)),
+        ]
+        for name, function in benchmarks:
+            microseconds = min(timeit.repeat(function, number=args.number, repeat=5)) / args.number * 1e6
+            print(f'{backend.name:<10} {name:<22} {microseconds:8.2f} us {peak_allocated_bytes(function):8d} B peak')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Microbenchmark of per-packet encryption cost, comparing the original implementation (a new CBC cipher per packet
+and byte-at-a-time padding) with robovac.crypto.
+
+Usage: python -m benchmarks.bench_crypto
+"""
+import timeit
+
+from Crypto.Cipher import AES
+
+from robovac import crypto
+
+# A typical command packet: magic number, 16 character local code and 5 byte user data
+PACKET = bytes(range(32))
+BATCH = [PACKET] * 100
+NUMBER = 2000
+
+
+def legacy_encrypt(data):
+    cipher = AES.new(bytes(bytearray(crypto._AES_KEY)), AES.MODE_CBC, bytes(bytearray(crypto._AES_IV)))
+    for i in range(16 - (len(data) % 16)):
+        data += b'\0'
+    return cipher.encrypt(data)
+
+
+def legacy_decrypt(data):
+    cipher = AES.new(bytes(bytearray(crypto._AES_KEY)), AES.MODE_CBC, bytes(bytearray(crypto._AES_IV)))
+    return cipher.decrypt(data)
+
+
+def report(name, function, packets=1):
+    seconds = min(timeit.repeat(function, number=NUMBER, repeat=5))
+    print(f'{name:<24} {seconds / NUMBER / packets * 1e6:8.2f} us/packet')
+
+
+def main():
+    encrypted = legacy_encrypt(PACKET)
+    assert crypto.encrypt(PACKET) == encrypted
+    assert crypto.decrypt(encrypted) == legacy_decrypt(encrypted)
+    assert crypto.encrypt_batch(BATCH) == [encrypted] * len(BATCH)
+
+    report('legacy encrypt', lambda: legacy_encrypt(PACKET))
+    report('encrypt', lambda: crypto.encrypt(PACKET))
+    report('encrypt_batch (100)', lambda: crypto.encrypt_batch(BATCH), len(BATCH))
+    report('legacy decrypt', lambda: legacy_decrypt(encrypted))
+    report('decrypt', lambda: crypto.decrypt(encrypted))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark of the time taken to import the robovac package in a fresh interpreter, as paid by every cold start of a CLI
+or serverless handler.
+
+Usage:
+    python -m benchmarks.bench_import [--runs 10] [--budget-scale 1.0]
+
+Exits with a non-zero status if any import takes longer than its budget, or loads one of the heavy dependencies that
+should only be loaded on first use. Budgets can be scaled up for slower machines.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# The interpreters are started here, so they import this checkout of robovac whatever the current directory
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules only present once a heavy dependency has really been loaded, rather than merely registered for lazy loading
+HEAVY_MODULES = ('requests.adapters', 'google.protobuf.descriptor_pool', 'Crypto.Cipher.AES')
+
+# (statement, budget in milliseconds, modules it must not load). Most of AsyncRobovac's budget is asyncio itself.
+SCENARIOS = [
+    ('import robovac', 5.0, HEAVY_MODULES + ('asyncio',)),
+    ('from robovac import Robovac', 50.0, HEAVY_MODULES),
+    ('from robovac import AsyncRobovac', 100.0, HEAVY_MODULES),
+]
+
+_MEASURE = '''
+import json, sys, time
+started_at = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started_at
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {modules!r} if name in sys.modules]}}))
+'''
+
+
+def measure(statement: str, modules, runs: int):
+    """ Best of several runs of the statement in a new interpreter, in milliseconds, and the heavy modules loaded. """
+    best = None
+    loaded = set()
+
+    for _ in range(runs):
+        code = _MEASURE.format(statement=statement, modules=tuple(modules))
+        output = subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE, cwd=_ROOT).stdout
+        result = json.loads(output)
+        best = result['seconds'] if best is None else min(best, result['seconds'])
+        loaded.update(result['loaded'])
+
+    return best * 1e3, sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the import time of the robovac package.')
+    parser.add_argument('--runs', type=int, default=10, help='Interpreters started per import')
+    parser.add_argument('--budget-scale', type=float, default=1.0, help='Multiplier applied to every budget')
+    args = parser.parse_args()
+
+    failures = []
+    for statement, budget, forbidden_modules in SCENARIOS:
+        budget *= args.budget_scale
+        milliseconds, loaded = measure(statement, forbidden_modules, args.runs)
+        print(f'{statement:<40} {milliseconds:8.2f} ms (budget {budget:.2f} ms)')
+
+        if milliseconds > budget:
+            failures.append(f'{statement}: {milliseconds:.2f} ms is over the budget of {budget:.2f} ms')
+        if loaded:
+            failures.append(f'{statement}: loaded {", ".join(loaded)}')
+
+    for failure in failures:
+        print(f'FAILED {failure}')
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
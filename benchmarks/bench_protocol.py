@@ -0,0 +1,156 @@
+"""
+Benchmarks of the protocol hot path, from encryption and Protobuf serialization up to end-to-end command and status
+latency against a simulated RoboVac on loopback.
+
+Usage:
+    python -m benchmarks.bench_protocol [--json results.json] [--compare baseline.json] [--tolerance 0.25]
+
+--compare exits with a non-zero status if any benchmark is slower than the baseline by more than the tolerance.
+Run with PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION set to 'python', 'upb' or 'cpp' to compare Protobuf backends.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import threading
+import timeit
+
+from google.protobuf.internal import api_implementation
+
+from robovac import LocalServerInfo_pb2, crypto
+from robovac.robovac import (
+    Robovac,
+    RobovacCommands,
+    RobovacModes,
+    RobovacStatus,
+    _build_robovac_command,
+    _command_template,
+    decode_status_columns,
+)
+from robovac.simulator import RobovacSimulator, _encrypt_frame
+
+LOCAL_CODE = 'ABCDEFGHIJKLMNOP'
+STATUS_PAYLOAD = bytes([0xA5, 2, 0, 0, 0, 0, 6, 0, 1, 0, 80, 1, 0, 0, 0xFA])
+
+
+def _build_command_message(local_code: str, magic_number: int, command_payload: bytes):
+    """ Build a command message field by field, as the client did before rendering packets from templates. """
+    message = LocalServerInfo_pb2.LocalServerMessage()
+    message.magic_num = magic_number
+    message.localcode = local_code
+    message.c.type = 0
+    message.c.usr_data = command_payload
+    return message
+
+
+def _status_response() -> LocalServerInfo_pb2.LocalServerMessage:
+    message = LocalServerInfo_pb2.LocalServerMessage()
+    message.localcode = LOCAL_CODE
+    message.magic_num = 123456
+    message.c.type = 1
+    message.c.usr_data = STATUS_PAYLOAD
+    return message
+
+
+def micro_benchmarks():
+    """ (name, function[, operations per call]) for benchmarks of single steps of the hot path. """
+    command = _build_command_message(LOCAL_CODE, 123456, _build_robovac_command(RobovacModes.WORK,
+                                                                                RobovacCommands.AUTO_CLEAN))
+    serialized_command = command.SerializeToString()
+    encrypted_command = crypto.encrypt(serialized_command)
+    response = _status_response()
+    serialized_response = response.SerializeToString()
+    decrypted_response = crypto.decrypt(_encrypt_frame(response))
+    template = _command_template(LOCAL_CODE, RobovacModes.WORK, RobovacCommands.AUTO_CLEAN)
+    payloads = [STATUS_PAYLOAD] * 1000
+
+    def parse_response():
+        LocalServerInfo_pb2.LocalServerMessage().ParseFromString(serialized_response)
+
+    return [
+        ('encrypt', lambda: crypto.encrypt(serialized_command)),
+        ('decrypt', lambda: crypto.decrypt(encrypted_command)),
+        ('SerializeToString', command.SerializeToString),
+        ('ParseFromString', parse_response),
+        ('_build_robovac_command', lambda: _build_robovac_command(RobovacModes.WORK, RobovacCommands.AUTO_CLEAN)),
+        ('_build_command_message', lambda: _build_command_message(LOCAL_CODE, 123456, b'\xa5\xe1\x02\xe3\xfa')),
+        ('MessageTemplate.render', lambda: template.render(123456)),
+        ('parse decrypted response',
+         lambda: Robovac._parse_local_server_message_from_decrypted_response(decrypted_response)),
+        ('RobovacStatus.from_bytes', lambda: RobovacStatus.from_bytes(STATUS_PAYLOAD)),
+        ('decode_status_columns (per status)', lambda: decode_status_columns(payloads), len(payloads)),
+    ]
+
+
+def measure(function, number, per_call=1) -> float:
+    """ Best of five runs, in microseconds per operation. """
+    return min(timeit.repeat(function, number=number, repeat=5)) / number / per_call * 1e6
+
+
+def end_to_end_benchmarks(number):
+    """ Measure command and status latency against a simulated RoboVac served from a background event loop. """
+    loop = asyncio.new_event_loop()
+    simulator = RobovacSimulator()
+    ((host, port, local_code),) = loop.run_until_complete(simulator.start(1, base_port=0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    robovac = Robovac(host, local_code, port)
+    predicting_robovac = Robovac(host, local_code, port, predict_magic_numbers=True)
+
+    try:
+        robovac.get_status()
+        predicting_robovac.get_status()
+
+        return {
+            'end-to-end command': measure(robovac.go_forward, number),
+            'end-to-end status': measure(robovac.get_status, number),
+            'end-to-end command (predicted magic)': measure(predicting_robovac.go_forward, number),
+            'end-to-end status (predicted magic)': measure(predicting_robovac.get_status, number),
+        }
+    finally:
+        robovac.disconnect()
+        predicting_robovac.disconnect()
+        asyncio.run_coroutine_threadsafe(simulator.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the RoboVac protocol hot path.')
+    parser.add_argument('--number', type=int, default=2000, help='Operations per timing run')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--compare', help='Compare results against a file written by --json')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    results = {}
+    for name, function, *per_call in micro_benchmarks():
+        results[name] = measure(function, args.number, *per_call)
+    results.update(end_to_end_benchmarks(max(1, args.number // 10)))
+
+    print(f'Python {platform.python_version()}, protobuf backend: {api_implementation.Type()}')
+    for name, microseconds in results.items():
+        print(f'{name:<40} {microseconds:10.2f} us')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'protobuf_backend': api_implementation.Type(), 'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+        regressions = [name for name, microseconds in results.items()
+                       if name in baseline and microseconds > baseline[name] * (1 + args.tolerance)]
+        for name in regressions:
+            print(f'REGRESSION {name}: {baseline[name]:.2f} us -> {results[name]:.2f} us')
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+""" Makes the repository root importable by the tests, e.g. benchmarks.bench_import, when run with plain pytest. """
@@ -1,2 +1,25 @@
-from robovac.robovac import Robovac
-from robovac.robovac import get_local_code
+# Public names are imported on first access (PEP 562), so `import robovac` stays cheap for short-lived processes
+# and e.g. asyncio is only loaded by those using AsyncRobovac.
+_EXPORTS = {
+    'Robovac': 'robovac.robovac',
+    'get_local_code': 'robovac.robovac',
+    'AsyncRobovac': 'robovac.aio',
+    'RobovacFleet': 'robovac.fleet',
+    'EufyCloudClient': 'robovac.cloud',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    import importlib
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,428 @@
+import asyncio
+import collections
+import logging
+from typing import AsyncIterator, Optional, Union
+
+from robovac.robovac import (
+    LocalServerInfo_pb2,
+    FrameReader,
+    RobovacAuthError,
+    RobovacCommands,
+    RobovacConnectionClosedError,
+    RobovacModes,
+    RobovacProtocolError,
+    RobovacStatus,
+    RobovacTimeoutError,
+    STATUS_SIZE,
+    _build_ping_packet,
+    _command_template,
+    _encrypt,
+    _is_status_push,
+    _STATUS_RESPONSE_ERRORS,
+    _status_request_template,
+    _status_usr_data,
+)
+from robovac.magic import MagicNumberSequencer
+from robovac.metrics import MetricsRegistry
+
+# Failures subscribe_status() recovers from by reconnecting. Timeouts are OSErrors, as they subclass socket.timeout.
+_SUBSCRIPTION_ERRORS = (OSError, RobovacConnectionClosedError) + _STATUS_RESPONSE_ERRORS
+
+
+class AsyncRobovac:
+    """
+    asyncio client for the RoboVac. Speaks the same encrypted Protobuf protocol as Robovac,
+    but over asyncio streams so many devices can be driven from a single event loop.
+
+    Every public coroutine accepts a timeout (in seconds) covering the whole operation. If it is
+    omitted, the default timeout given to the constructor is used. An operation which times out raises
+    RobovacTimeoutError, and the connection is dropped, as a late reply would otherwise be read by the
+    next operation.
+
+    A client may be shared by many coroutines. Operations take turns, each holding the client from taking
+    its magic number until its reply has been read, and a single task reads every message from the
+    connection.
+    """
+
+    def __init__(self,
+                 ip: str,
+                 local_code: str,
+                 port=55556,
+                 timeout=10.0,
+                 predict_magic_numbers=False,
+                 metrics: MetricsRegistry = None,
+                 connect_timeout=5.0,
+                 read_timeout=None):
+        """
+        :param connect_timeout: Maximum seconds for each connection attempt.
+        :param read_timeout: Maximum seconds to wait for each reply.
+        """
+        self.ip = ip
+        self.port = port
+        self.local_code = local_code
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.magic_numbers = MagicNumberSequencer(predict_magic_numbers)
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self._reader = None
+        self._writer = None
+        self._reader_task = None  # type: Optional[asyncio.Task]
+        self._frames = FrameReader()
+        self._reply = None  # type: Optional[asyncio.Future]
+        self._pushes = collections.deque(maxlen=16)
+        self._push_waiter = None  # type: Optional[asyncio.Future]
+        # Created on first use, as before Python 3.10 an asyncio.Lock is bound to the event loop current when created
+        self._lock = None  # type: Optional[asyncio.Lock]
+
+    async def connect(self, timeout=None) -> None:
+        """ Connect to the RoboVac at the given IP and port """
+        try:
+            await asyncio.wait_for(self._operation_lock().acquire(), self._timeout(timeout))
+        except asyncio.TimeoutError as e:
+            self.metrics.increment('timeouts')
+            raise RobovacTimeoutError(f'Timed out waiting for another operation on the RoboVac at {self.ip}') from e
+
+        try:
+            await self._connect(timeout)
+        finally:
+            self._lock.release()
+
+    async def disconnect(self) -> None:
+        """ Disconnect from the RoboVac. Does nothing if no connection exists. """
+        self._close()
+
+    async def _connect(self, timeout=None) -> None:
+        self._close()
+        self.magic_numbers.invalidate()
+        self._frames.reset()
+        self._pushes.clear()
+        timeout = self._timeout(timeout)
+        if self.connect_timeout is not None:
+            timeout = self.connect_timeout if timeout is None else min(timeout, self.connect_timeout)
+
+        try:
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.ip, self.port), timeout)
+        except asyncio.TimeoutError as e:
+            self.metrics.increment('timeouts')
+            raise RobovacTimeoutError(f'Timed out connecting to the RoboVac at {self.ip}') from e
+
+        self._reader_task = asyncio.ensure_future(self._read_messages(self._reader))
+        self.metrics.increment('connects')
+
+    def _close(self, error: Exception = None) -> None:
+        """ Close the connection, failing the reply being waited for and waking any subscriber. """
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except OSError as e:
+                logging.exception(e)
+
+            self._reader = None
+            self._writer = None
+
+        if self._reply is not None and not self._reply.done():
+            self._reply.set_exception(error or RobovacConnectionClosedError('The connection to the RoboVac was closed'))
+        if self._push_waiter is not None and not self._push_waiter.done():
+            self._push_waiter.set_result(None)
+
+    async def get_status(self, timeout=None) -> RobovacStatus:
+        """ Get the status of the RoboVac device (battery level, mode, charging, etc). """
+        return await self._run(self._get_status, timeout)
+
+    async def subscribe_status(self, min_poll_interval=5.0, max_poll_interval=60.0) -> AsyncIterator[RobovacStatus]:
+        """
+        Yield the status of the RoboVac every time it changes, keeping the connection open.
+
+        Status updates pushed by the RoboVac are used whenever they arrive. If none arrives within the poll interval,
+        the status is polled instead. The poll interval doubles, up to max_poll_interval, for as long as the status
+        stays the same, and drops back to min_poll_interval once it changes or pushes resume.
+
+        Failed polls are retried on a new connection, backing off in the same way. Only a refused local code ends the
+        subscription, by raising RobovacAuthError.
+        """
+        last_status = None
+        poll_interval = min_poll_interval
+
+        while True:
+            try:
+                push = await asyncio.wait_for(self._receive_push(), poll_interval)
+            except asyncio.TimeoutError:
+                push = None
+            except _SUBSCRIPTION_ERRORS:
+                # Polling below reconnects to the RoboVac
+                await self.disconnect()
+                push = None
+
+            if push is not None and len(push.c.usr_data) >= STATUS_SIZE:
+                status = RobovacStatus.from_bytes(push.c.usr_data)
+                poll_interval = min_poll_interval
+            else:
+                try:
+                    status = await self.get_status()
+                except _SUBSCRIPTION_ERRORS as e:
+                    logging.warning('Could not poll the status of the RoboVac at %s: %s', self.ip, e)
+                    await self.disconnect()
+                    await asyncio.sleep(poll_interval)
+                    poll_interval = min(poll_interval * 2, max_poll_interval)
+                    continue
+
+                if status == last_status:
+                    # Nothing has changed, so poll less often
+                    poll_interval = min(poll_interval * 2, max_poll_interval)
+                else:
+                    poll_interval = min_poll_interval
+
+            if status != last_status:
+                last_status = status
+                yield status
+
+    async def start_auto_clean(self, timeout=None):
+        """ Tell the RoboVac to start its auto-clean programme. """
+        await self._send_command(RobovacModes.WORK, RobovacCommands.AUTO_CLEAN, timeout)
+
+    async def start_spot_clean(self, timeout=None):
+        """ Tell the RoboVac to start its spot-clean programme. """
+        await self._send_command(RobovacModes.WORK, RobovacCommands.SPOT_CLEAN, timeout)
+
+    async def start_edge_clean(self, timeout=None):
+        """ Tell the RoboVac to start its edge-clean programme. """
+        await self._send_command(RobovacModes.WORK, RobovacCommands.EDGE_CLEAN, timeout)
+
+    async def start_single_room_clean(self, timeout=None):
+        """ Tell the RoboVac to clean a single room. """
+        await self._send_command(RobovacModes.WORK, RobovacCommands.SINGLE_ROOM_CLEAN, timeout)
+
+    async def stop(self, timeout=None):
+        """ Tell the RoboVac to stop cleaning. The RoboVac will not return to its charging base. """
+        await self._send_command(RobovacModes.WORK, RobovacCommands.STOP_CLEAN, timeout)
+
+    async def go_home(self, timeout=None):
+        """ Tell the RoboVac to return to its charging base. """
+        await self._send_command(RobovacModes.WORK, RobovacCommands.GO_HOME, timeout)
+
+    async def start_find_me(self, timeout=None):
+        """ Start the 'find me' mode. The RoboVac will repeatedly play a chime. """
+        await self._send_command(RobovacModes.FIND_ME, RobovacCommands.START_RING, timeout)
+
+    async def stop_find_me(self, timeout=None):
+        """ Stop the 'find me' mode. """
+        await self._send_command(RobovacModes.FIND_ME, RobovacCommands.STOP_RING, timeout)
+
+    async def use_normal_speed(self, timeout=None):
+        """ Tell the RoboVac to use the standard fan speed. """
+        await self._send_command(RobovacModes.SET_SPEED, RobovacCommands.SLOW_SPEED, timeout)
+
+    async def use_max_speed(self, timeout=None):
+        """ Tell the RoboVac to use the maximum possible fan speed. """
+        await self._send_command(RobovacModes.SET_SPEED, RobovacCommands.FAST_SPEED, timeout)
+
+    async def go_forward(self, timeout=None):
+        """ Tell the RoboVac to move forward without vacuuming. """
+        await self._send_command(RobovacModes.GO_FORWARD, RobovacCommands.MOVE, timeout)
+
+    async def go_backward(self, timeout=None):
+        """ Tell the RoboVac to move backward without vacuuming. """
+        await self._send_command(RobovacModes.GO_BACKWARD, RobovacCommands.MOVE, timeout)
+
+    async def go_left(self, timeout=None):
+        """ Tell the RoboVac to turn left without vacuuming. """
+        await self._send_command(RobovacModes.GO_LEFT, RobovacCommands.MOVE, timeout)
+
+    async def go_right(self, timeout=None):
+        """ Tell the RoboVac to turn right without vacuuming. """
+        await self._send_command(RobovacModes.GO_RIGHT, RobovacCommands.MOVE, timeout)
+
+    def _timeout(self, timeout):
+        return self.timeout if timeout is None else timeout
+
+    def _operation_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        return self._lock
+
+    async def _run(self, operation, timeout, *args):
+        """ Run an operation under a timeout, which also covers waiting for other operations to finish. """
+        try:
+            return await asyncio.wait_for(self._exclusively(operation, *args), self._timeout(timeout))
+        except RobovacTimeoutError:
+            raise
+        except asyncio.TimeoutError as e:
+            self.metrics.increment('timeouts')
+            raise RobovacTimeoutError(f'Timed out waiting for the RoboVac at {self.ip}') from e
+
+    async def _exclusively(self, operation, *args):
+        """ Run an operation holding the client, dropping the connection if the operation is cut off. """
+        async with self._operation_lock():
+            try:
+                return await operation(*args)
+            except (asyncio.CancelledError, RobovacTimeoutError):
+                # A predicted magic number may have been ignored by the RoboVac
+                self.magic_numbers.invalidate()
+                self._close()
+                raise
+
+    async def _send_command(self, mode: RobovacModes, command: RobovacCommands, timeout):
+        await self._run(self._send_command_message, timeout, mode, command)
+
+    async def _send_command_message(self, mode: RobovacModes, command: RobovacCommands):
+        with self.metrics.timer('command'):
+            template = _command_template(self.local_code, mode, command)
+            await self._send_packet(template.render(await self._get_magic_number()), False)
+
+    async def _get_status(self) -> RobovacStatus:
+        with self.metrics.timer('status'):
+            return await self._get_status_with_retry()
+
+    async def _get_status_with_retry(self) -> RobovacStatus:
+        predicted = self.magic_numbers.synchronised
+
+        try:
+            return await self._request_status()
+        except _STATUS_RESPONSE_ERRORS:
+            if not predicted:
+                raise
+
+        # The predicted magic number may have been rejected, so ping to resynchronise and try again
+        self.magic_numbers.invalidate()
+        return await self._request_status()
+
+    async def _request_status(self) -> RobovacStatus:
+        template = _status_request_template(self.local_code)
+        robovac_response = await self._send_packet(template.render(await self._get_magic_number()), True)
+        self.magic_numbers.observe(robovac_response.magic_num)
+
+        return RobovacStatus.from_bytes(_status_usr_data(robovac_response))
+
+    async def _get_magic_number(self) -> int:
+        """
+        Retrieve the next magic number. If it cannot be predicted, a ping packet is sent and the response
+        parsed in order to retrieve it.
+        """
+        magic_number = self.magic_numbers.take()
+        if magic_number is not None:
+            return magic_number
+
+        pong = await self._handshake()
+        return self.magic_numbers.synchronise(pong.magic_num)
+
+    async def _handshake(self) -> 'LocalServerInfo_pb2.LocalServerMessage':
+        """
+        Ping the RoboVac. It closes the connection instead of replying to a packet with the wrong local code, so a
+        connection closed in reply to a ping twice in a row is taken to be an authentication failure.
+        """
+        for attempt in range(2):
+            try:
+                with self.metrics.timer('ping'):
+                    return await self._send_packet(_build_ping_packet(self.local_code), True)
+            except (RobovacConnectionClosedError, ConnectionResetError) as e:
+                await self.disconnect()
+                if attempt:
+                    raise RobovacAuthError(f'The RoboVac at {self.ip} refused the local code') from e
+
+    async def _send_packet(self,
+                           raw_packet_data: bytes,
+                           receive: bool) -> Union[None, 'LocalServerInfo_pb2.LocalServerMessage']:
+        """
+        Send a serialized packet to the RoboVac. This method handles all the required encryption.
+
+        Will connect to the RoboVac if no connection exists, and attempt to reconnect once if sending fails.
+        :param receive: If true, the packet sent in reply by the RoboVac will be parsed and returned.
+        """
+        encrypted_packet_data = _encrypt(raw_packet_data)
+
+        if self._writer is None:
+            await self._connect()
+
+        # Expected before sending, as the reply may arrive while the packet is being written
+        reply = self._expect_reply() if receive else None
+        try:
+            self._writer.write(encrypted_packet_data)
+            await self._writer.drain()
+        except OSError as e:
+            logging.exception(e)
+            self.metrics.increment('send_errors')
+            self.metrics.increment('reconnects')
+            await self._connect()
+            reply = self._expect_reply() if receive else None
+            self._writer.write(encrypted_packet_data)
+            await self._writer.drain()
+
+        self.metrics.increment('bytes_sent', len(encrypted_packet_data))
+
+        if reply is None:
+            return None
+
+        try:
+            return await asyncio.wait_for(reply, self.read_timeout)
+        except asyncio.TimeoutError as e:
+            self.metrics.increment('timeouts')
+            raise RobovacTimeoutError(f'Timed out waiting for a reply from the RoboVac at {self.ip}') from e
+        finally:
+            self._reply = None
+
+    def _expect_reply(self) -> asyncio.Future:
+        self._reply = asyncio.get_event_loop().create_future()
+        return self._reply
+
+    async def _receive_push(self) -> 'LocalServerInfo_pb2.LocalServerMessage':
+        """ Return the next status update pushed by the RoboVac. """
+        if self._writer is None:
+            await self.connect()
+
+        while not self._pushes:
+            if self._writer is None:
+                raise RobovacConnectionClosedError('The connection to the RoboVac was closed')
+
+            if self._push_waiter is None or self._push_waiter.done():
+                self._push_waiter = asyncio.get_event_loop().create_future()
+            # Shielded, as one subscriber giving up must not cancel the wait of another
+            await asyncio.shield(self._push_waiter)
+
+        return self._pushes.popleft()
+
+    async def _read_messages(self, reader: asyncio.StreamReader) -> None:
+        """
+        Read every message sent on the connection for as long as it is open, handing replies to the operation
+        waiting for one, and keeping status updates pushed by the RoboVac for subscribe_status().
+        """
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    raise RobovacConnectionClosedError('The RoboVac closed the connection')
+
+                self.metrics.increment('bytes_received', len(data))
+                try:
+                    messages = self._frames.feed(data)
+                except RobovacProtocolError:
+                    self.metrics.increment('protocol_errors')
+                    raise
+
+                for message in messages:
+                    self._dispatch(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Unless the connection has already been replaced, fail whatever is waiting on it
+            if self._reader is reader:
+                self._reader_task = None
+                self._close(e)
+
+    def _dispatch(self, message: 'LocalServerInfo_pb2.LocalServerMessage') -> None:
+        if _is_status_push(message):
+            self._pushes.append(message)
+            if self._push_waiter is not None and not self._push_waiter.done():
+                self._push_waiter.set_result(None)
+        elif self._reply is not None and not self._reply.done():
+            if message.WhichOneof('playload') == 'c':
+                # Pushes still queued are older than this status, so must not be yielded after it
+                self._pushes.clear()
+            self._reply.set_result(message)
+        else:
+            logging.debug('Discarding a message from the RoboVac which no operation is waiting for')
@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class StatusCache(Generic[T]):
+    """
+    Cache a RoboVac's status for a short time.
+
+    Callers arriving while the status is being fetched wait for that fetch rather than starting their own, so
+    concurrent callers cost a single round trip. Invalidating the cache, e.g. after sending a command, also
+    discards the result of any fetch already in flight: its waiters still get it, but later callers fetch again.
+    """
+
+    def __init__(self, ttl: float):
+        """ :param ttl: Seconds for which a fetched status is reused. """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._status = None  # type: Optional[T]
+        self._expires_at = 0.0
+        self._in_flight = None  # type: Optional[Future]
+        self._generation = 0
+
+    def get(self, fetch: Callable[[], T], timeout: Optional[float] = None) -> T:
+        """
+        Return the cached status, calling fetch to refresh it if it has expired.
+
+        :param timeout: Seconds to wait for a fetch already in flight.
+        :raises concurrent.futures.TimeoutError: If the fetch in flight did not finish in time.
+        """
+        with self._lock:
+            if self._status is not None and time.monotonic() < self._expires_at:
+                self.hits += 1
+                return self._status
+
+            if self._in_flight is not None:
+                self.coalesced += 1
+                in_flight = self._in_flight
+            else:
+                self.misses += 1
+                in_flight = None
+                future = self._in_flight = Future()
+                generation = self._generation
+
+        if in_flight is not None:
+            return in_flight.result(timeout)
+
+        try:
+            status = fetch()
+        except BaseException as e:
+            with self._lock:
+                self._finish(future)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._finish(future)
+            if generation == self._generation:
+                self._status = status
+                self._expires_at = time.monotonic() + self.ttl
+
+        future.set_result(status)
+        return status
+
+    def invalidate(self) -> None:
+        """ Discard the cached status, so the next caller fetches it again rather than joining a fetch in flight. """
+        with self._lock:
+            self._status = None
+            self._in_flight = None
+            self._generation += 1
+
+    def _finish(self, future: Future) -> None:
+        """ Stop later callers joining a fetch, unless the cache was invalidated and another fetch started since. """
+        if self._in_flight is future:
+            self._in_flight = None
+
+    def stats(self) -> dict:
+        """ Counters describing how many requests were served from the cache. """
+        return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced}
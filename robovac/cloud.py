@@ -0,0 +1,191 @@
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from robovac.lazy import lazy_import
+
+requests = lazy_import('requests')
+
+EUFY_API_URL = 'https://home-api.eufylife.com'
+
+_CLIENT_ID = 'eufyhome-app'
+_CLIENT_SECRET = 'GQCpr9dSp3uQpsOMgJ4xQ'
+
+
+class EufyApiError(Exception):
+    """ Exception raised when there's a problem communicating with the Eufy API """
+
+
+class EufyDevice(NamedTuple):
+    """ A device registered to a EufyHome account. """
+
+    id: str
+    name: str
+    ip: str
+    mac: str
+    local_code: str
+
+
+def normalise_mac(mac: str) -> str:
+    """ Lower case a MAC address and separate it with colons, so differently formatted addresses compare equal. """
+    digits = ''.join(c for c in mac.lower() if c in '0123456789abcdef')
+    return ':'.join(digits[i:i + 2] for i in range(0, len(digits), 2))
+
+
+class EufyCloudClient:
+    """
+    Client for the Eufy cloud API, used to look up the local codes of RoboVacs.
+
+    A single HTTP session is kept, so its connections are reused between requests. The access token is reused until
+    it expires, and the device list is fetched once and indexed by IP address, MAC address and device id. Lookups of
+    devices missing from the list refresh it once, in case a device was added or changed address.
+
+    Based on a similar method in the google/python-lakeside project:
+    https://github.com/google/python-lakeside/blob/c3f2fef2ca35aac49d2271b436c144b1b059aa6a/lakeside/__init__.py#L30
+    """
+
+    def __init__(self, username: str, password: str, base_url=EUFY_API_URL, timeout=10.0, token_lifetime=3600.0):
+        """
+        :param base_url: URL of the Eufy API, e.g. that of a local stand-in for testing.
+        :param timeout: Seconds to wait for each HTTP request.
+        :param token_lifetime: Seconds an access token is reused for, if the API doesn't say when it expires.
+        """
+        self.username = username
+        self.password = password
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.token_lifetime = token_lifetime
+        self._session = None
+        self._token = None
+        self._token_expires_at = 0.0
+        self._devices = None  # type: Optional[List[EufyDevice]]
+        self._by_ip = {}  # type: Dict[str, EufyDevice]
+        self._by_mac = {}  # type: Dict[str, EufyDevice]
+        self._by_id = {}  # type: Dict[str, EufyDevice]
+
+    def __enter__(self) -> 'EufyCloudClient':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def session(self) -> 'requests.Session':
+        if self._session is None:
+            self._session = requests.Session()
+
+        return self._session
+
+    def close(self) -> None:
+        """ Close the HTTP session's pooled connections. """
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def token(self) -> str:
+        """ Return an access token, logging in if there is none or it has expired. """
+        if self._token is None or time.monotonic() >= self._token_expires_at:
+            self.login()
+
+        return self._token
+
+    def login(self) -> None:
+        """ Log in to the Eufy API, replacing any existing access token. """
+        login_payload = {'client_id': _CLIENT_ID, 'client_Secret': _CLIENT_SECRET,
+                         'email': self.username, 'password': self.password}
+        login_request = self.session.post(f'{self.base_url}/v1/user/email/login', json=login_payload,
+                                          timeout=self.timeout)
+
+        if login_request.status_code != 200:
+            raise EufyApiError('Could not authenticate with Eufy API. Is your username and password correct?')
+
+        login_response = login_request.json()
+        self._token = login_response['access_token']
+        self._token_expires_at = time.monotonic() + float(login_response.get('expires_in', self.token_lifetime))
+
+    def devices(self, refresh=False) -> List[EufyDevice]:
+        """ Every device registered to the account. The list is only fetched again if refresh is true. """
+        if self._devices is None or refresh:
+            self._index(self._fetch_devices())
+
+        return self._devices
+
+    def find_device(self, ip_address: str = None, mac: str = None, device_id: str = None) -> EufyDevice:
+        """ Find a device by any one of its IP address, MAC address or device id. """
+        if ip_address is not None:
+            index, key = '_by_ip', ip_address
+        elif mac is not None:
+            index, key = '_by_mac', normalise_mac(mac)
+        elif device_id is not None:
+            index, key = '_by_id', device_id
+        else:
+            raise ValueError('An IP address, MAC address or device id is required')
+
+        # The indexes are replaced whenever the list is fetched, so are looked up afresh after each fetch
+        self.devices()
+        if key not in getattr(self, index):
+            self.devices(refresh=True)
+
+        if key not in getattr(self, index):
+            raise EufyApiError(f'Cannot find device {key}. Check that it is registered to the account.')
+
+        return getattr(self, index)[key]
+
+    def get_local_code(self, ip_address: str) -> str:
+        """ Retrieve the local code of the device with the given IP address. """
+        return self.find_device(ip_address=ip_address).local_code
+
+    def get_local_codes(self, ip_addresses: Iterable[str]) -> Dict[str, str]:
+        """
+        Retrieve the local codes of many devices from a single device listing.
+
+        :return: Mapping of IP address to local code.
+        """
+        ip_addresses = list(ip_addresses)
+
+        self.devices()
+        if any(ip_address not in self._by_ip for ip_address in ip_addresses):
+            self.devices(refresh=True)
+
+        missing = [ip_address for ip_address in ip_addresses if ip_address not in self._by_ip]
+        if missing:
+            raise EufyApiError(f'Cannot find local codes for devices with IP addresses {", ".join(missing)}')
+
+        return {ip_address: self._by_ip[ip_address].local_code for ip_address in ip_addresses}
+
+    def _fetch_devices(self) -> List[EufyDevice]:
+        devices_request = self._get('/v1/device/list/devices-and-groups')
+
+        if devices_request.status_code == 401:
+            # The token was revoked or expired early
+            self.login()
+            devices_request = self._get('/v1/device/list/devices-and-groups')
+
+        if devices_request.status_code != 200:
+            raise EufyApiError('Could not list devices from Eufy API.')
+
+        devices = []
+        for item in devices_request.json()['items']:
+            if 'device' not in item:
+                continue
+
+            device = item['device']
+            wifi = device.get('wifi') or {}
+            devices.append(EufyDevice(
+                id=device.get('id'),
+                name=device.get('alias_name') or device.get('name'),
+                ip=wifi.get('lan_ip_addr'),
+                mac=normalise_mac(wifi['mac_address']) if wifi.get('mac_address') else None,
+                local_code=device.get('local_code'),
+            ))
+
+        return devices
+
+    def _get(self, path: str) -> 'requests.Response':
+        headers = {'token': self.token(), 'category': 'Home'}
+        return self.session.get(f'{self.base_url}{path}', headers=headers, timeout=self.timeout)
+
+    def _index(self, devices: List[EufyDevice]) -> None:
+        self._devices = devices
+        self._by_ip = {device.ip: device for device in devices if device.ip}
+        self._by_mac = {device.mac: device for device in devices if device.mac}
+        self._by_id = {device.id: device for device in devices if device.id}
@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Tuple
+
+
+class EufyCloudSimulator:
+    """
+    A local stand-in for the Eufy cloud API, serving the login and device list endpoints used by EufyCloudClient.
+
+    It runs an HTTP server on a background thread. Tokens expire after token_lifetime seconds, or once revoked, after
+    which the device list is refused until the client logs in again. The number of logins and device listings served
+    are counted. Unlike robovac.simulator, it needs neither Protobuf nor AES.
+    """
+
+    def __init__(self,
+                 devices: Iterable[Tuple[str, str]],
+                 username='user@example.com',
+                 password='password',
+                 token_lifetime=3600.0):
+        """ :param devices: (ip, local_code) pairs, e.g. those returned by RobovacSimulator.start(). """
+        self.devices = list(devices)
+        self.username = username
+        self.password = password
+        self.token_lifetime = token_lifetime
+        self.logins = 0
+        self.device_listings = 0
+        self._tokens = {}  # type: Dict[str, float]
+        self._server = None
+        self._thread = None
+
+    def start(self, host='127.0.0.1', port=0) -> str:
+        """ Start serving, returning the base URL to pass to EufyCloudClient. """
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                simulator._handle(self)
+
+            def do_GET(self):
+                simulator._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def revoke_tokens(self) -> None:
+        """ Revoke every token issued so far, as if they had expired. """
+        self._tokens.clear()
+
+    def device_list(self) -> dict:
+        """ The device list response, in the shape returned by the Eufy API. """
+        return {'items': [
+            {'device': {
+                'id': f'simulated-device-{index}',
+                'alias_name': f'Simulated RoboVac {index}',
+                'local_code': local_code,
+                'wifi': {'lan_ip_addr': ip, 'mac_address': f'02:ab:cd:ef:{index >> 8 & 0xFF:02x}:{index & 0xFF:02x}'},
+            }}
+            for index, (ip, local_code) in enumerate(self.devices)
+        ]}
+
+    def _handle(self, request: BaseHTTPRequestHandler) -> None:
+        if request.command == 'POST' and request.path == '/v1/user/email/login':
+            body = json.loads(request.rfile.read(int(request.headers.get('Content-Length', 0))) or b'{}')
+            if body.get('email') != self.username or body.get('password') != self.password:
+                self._reply(request, 401, {'message': 'Invalid username or password'})
+                return
+
+            self.logins += 1
+            token = uuid.uuid4().hex
+            self._tokens[token] = time.monotonic() + self.token_lifetime
+            self._reply(request, 200, {'access_token': token, 'expires_in': self.token_lifetime})
+        elif request.command == 'GET' and request.path == '/v1/device/list/devices-and-groups':
+            if self._tokens.get(request.headers.get('token'), 0) <= time.monotonic():
+                self._reply(request, 401, {'message': 'Invalid token'})
+                return
+
+            self.device_listings += 1
+            self._reply(request, 200, self.device_list())
+        else:
+            self._reply(request, 404, {'message': 'Not found'})
+
+    @staticmethod
+    def _reply(request: BaseHTTPRequestHandler, status: int, body: dict) -> None:
+        encoded = json.dumps(body).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(encoded)))
+        request.end_headers()
+        request.wfile.write(encoded)
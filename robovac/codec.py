@@ -0,0 +1,305 @@
+import os
+from typing import NamedTuple, Optional, Tuple
+
+from robovac.lazy import lazy_import
+
+LocalServerInfo_pb2 = lazy_import('robovac.LocalServerInfo_pb2')
+
+# LocalServerMessage.UserDataMessage.UserDataType
+SEND_USER_DATA_TO_DEVICE = 0
+GET_DEVICE_STATUS_DATA = 1
+SEND_STATUS_DATA_TO_APP = 2
+
+# LocalServerMessage.PingPacketMessage.PingPacketType
+PING_REQUEST = 0
+PING_RESPONSE = 1
+
+
+class MessageDecodeError(ValueError):
+    """ Exception raised when bytes received from a RoboVac are not a valid Local Server Message """
+
+
+def encode_varint(value: int) -> bytes:
+    """ Encode a non-negative integer as a Protobuf base 128 varint. """
+    encoded = bytearray()
+
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+
+    encoded.append(value)
+    return bytes(encoded)
+
+
+# Tag of LocalServerMessage.magic_num: field number 1, wire type 0 (varint)
+_MAGIC_NUM_TAG = b'\x08'
+
+
+class MessageTemplate:
+    """
+    A pre-serialized Local Server Message in which only the magic number changes between packets.
+
+    Protobuf serializes fields in field number order and magic_num is field 1, so a message serializes to the
+    magic number field followed by bytes that are the same for every packet. Rendering a packet only encodes the
+    magic number, skipping message construction and SerializeToString.
+    """
+
+    __slots__ = ('suffix',)
+
+    def __init__(self, suffix: bytes):
+        """ :param suffix: The serialized message, excluding the magic_num field. """
+        self.suffix = suffix
+
+    def render(self, magic_number: int) -> bytes:
+        """ Serialize the message with the given magic number. """
+        return _MAGIC_NUM_TAG + encode_varint(magic_number) + self.suffix
+
+
+# Tags of the fields the client uses, as (field number << 3) | wire type. Wire type 0 is a varint and 2 is
+# length-delimited. The payload oneof is named 'playload' in LocalServerInfo.proto.
+_LOCALCODE_TAG = b'\x12'
+_PING_TAG = b'\x1a'
+_USER_DATA_TAG = b'\x2a'
+_TYPE_TAG = b'\x08'
+_USR_DATA_TAG = b'\x12'
+_PAYLOAD_FIELDS = {3: 'a', 4: 'b', 5: 'c', 6: 'd'}
+
+
+class PingPacketMessage(NamedTuple):
+    type: int = PING_REQUEST
+
+
+class UserDataMessage(NamedTuple):
+    type: int = SEND_USER_DATA_TO_DEVICE
+    usr_data: bytes = b''
+
+
+class LocalServerMessage(NamedTuple):
+    """
+    A decoded Local Server Message, holding only the fields the client reads. Unset fields hold their Protobuf
+    defaults, so it can be read in the same way as the generated message.
+    """
+
+    magic_num: int = 0
+    localcode: str = ''
+    a: PingPacketMessage = PingPacketMessage()
+    c: UserDataMessage = UserDataMessage()
+    playload: Optional[str] = None
+
+    def WhichOneof(self, oneof_group: str) -> Optional[str]:
+        """ Name of the payload field that is set, like the generated message. """
+        return self.playload
+
+
+def _decode_varint(data: bytes, position: int) -> Tuple[int, int]:
+    """ Decode the varint starting at the given position, returning it and the position following it. """
+    result = 0
+    shift = 0
+
+    while True:
+        if position >= len(data):
+            raise MessageDecodeError('Truncated varint')
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+
+        if not byte & 0x80:
+            return result, position
+
+        shift += 7
+        if shift >= 70:
+            raise MessageDecodeError('Varint is too long')
+
+
+def _decode_fields(data: bytes):
+    """ Yield the (field number, wire type, value) of every field, skipping over fixed-width fields. """
+    position = 0
+    end = len(data)
+
+    while position < end:
+        key, position = _decode_varint(data, position)
+        field_number = key >> 3
+        wire_type = key & 7
+
+        if field_number == 0:
+            raise MessageDecodeError('Invalid field number 0')
+
+        if wire_type == 0:
+            value, position = _decode_varint(data, position)
+        elif wire_type == 2:
+            length, position = _decode_varint(data, position)
+            if position + length > end:
+                raise MessageDecodeError('Truncated length-delimited field')
+            value = data[position:position + length]
+            position += length
+        elif wire_type == 1 or wire_type == 5:
+            position += 8 if wire_type == 1 else 4
+            if position > end:
+                raise MessageDecodeError('Truncated fixed-width field')
+            continue
+        else:
+            raise MessageDecodeError(f'Unsupported wire type {wire_type}')
+
+        yield field_number, wire_type, value
+
+
+def _decode_submessage(data: bytes, fields: dict) -> dict:
+    """ Merge the type and usr_data fields of a payload message into the given dict, as Protobuf merges repeats. """
+    for field_number, wire_type, value in _decode_fields(data):
+        if field_number == 1 and wire_type == 0:
+            fields['type'] = value
+        elif field_number == 2 and wire_type == 2:
+            fields['usr_data'] = bytes(value)
+
+    return fields
+
+
+class PurePythonCodec:
+    """
+    A hand-rolled codec for the few Local Server Messages the client sends and receives, without the Protobuf
+    runtime. It produces the same bytes as the generated message, encoding fields in field number order.
+    """
+
+    name = 'python'
+
+    @staticmethod
+    def encode(magic_num: Optional[int] = None,
+               localcode: Optional[str] = None,
+               ping_type: Optional[int] = None,
+               user_data_type: Optional[int] = None,
+               usr_data: Optional[bytes] = None) -> bytes:
+        """ Serialize a message. Fields left as None are not set; at most one of the ping and user data is set. """
+        encoded = bytearray()
+
+        if magic_num is not None:
+            encoded += _MAGIC_NUM_TAG + encode_varint(magic_num)
+
+        if localcode is not None:
+            localcode = localcode.encode('utf-8')
+            encoded += _LOCALCODE_TAG + encode_varint(len(localcode)) + localcode
+
+        if ping_type is not None:
+            encoded += _PING_TAG + b'\x02' + _TYPE_TAG + encode_varint(ping_type)
+        elif user_data_type is not None or usr_data is not None:
+            user_data = b''
+            if user_data_type is not None:
+                user_data += _TYPE_TAG + encode_varint(user_data_type)
+            if usr_data is not None:
+                user_data += _USR_DATA_TAG + encode_varint(len(usr_data)) + usr_data
+
+            encoded += _USER_DATA_TAG + encode_varint(len(user_data)) + user_data
+
+        return bytes(encoded)
+
+    @staticmethod
+    def decode(data: bytes) -> LocalServerMessage:
+        """ Parse a serialized message. Fields the client doesn't use are skipped. """
+        magic_num = 0
+        localcode = ''
+        payloads = {}
+        playload = None
+
+        for field_number, wire_type, value in _decode_fields(data):
+            if field_number == 1 and wire_type == 0:
+                magic_num = value & 0xFFFFFFFF
+            elif field_number == 2 and wire_type == 2:
+                try:
+                    localcode = bytes(value).decode('utf-8')
+                except UnicodeDecodeError as e:
+                    raise MessageDecodeError('localcode is not valid UTF-8') from e
+            elif field_number in _PAYLOAD_FIELDS and wire_type == 2:
+                # Setting a field of a oneof clears the others, but repeats of the same field are merged
+                name = _PAYLOAD_FIELDS[field_number]
+                if name != playload:
+                    payloads = {}
+                    playload = name
+                _decode_submessage(value, payloads)
+
+        if playload == 'a':
+            ping = PingPacketMessage(payloads.get('type', PING_REQUEST))
+            return LocalServerMessage(magic_num, localcode, ping, UserDataMessage(), 'a')
+        if playload == 'c':
+            user_data = UserDataMessage(payloads.get('type', SEND_USER_DATA_TO_DEVICE), payloads.get('usr_data', b''))
+            return LocalServerMessage(magic_num, localcode, PingPacketMessage(), user_data, 'c')
+
+        return LocalServerMessage(magic_num, localcode, PingPacketMessage(), UserDataMessage(), playload)
+
+
+class ProtobufCodec:
+    """ Codec using the generated LocalServerInfo_pb2 module and the Protobuf runtime. """
+
+    name = 'protobuf'
+
+    @staticmethod
+    def encode(magic_num: Optional[int] = None,
+               localcode: Optional[str] = None,
+               ping_type: Optional[int] = None,
+               user_data_type: Optional[int] = None,
+               usr_data: Optional[bytes] = None) -> bytes:
+        """ Serialize a message. Fields left as None are not set; at most one of the ping and user data is set. """
+        message = LocalServerInfo_pb2.LocalServerMessage()
+
+        if magic_num is not None:
+            message.magic_num = magic_num
+        if localcode is not None:
+            message.localcode = localcode
+
+        if ping_type is not None:
+            message.a.type = ping_type
+        elif user_data_type is not None or usr_data is not None:
+            message.c.SetInParent()
+            if user_data_type is not None:
+                message.c.type = user_data_type
+            if usr_data is not None:
+                message.c.usr_data = usr_data
+
+        return message.SerializeToString()
+
+    @staticmethod
+    def decode(data: bytes) -> 'LocalServerInfo_pb2.LocalServerMessage':
+        """ Parse a serialized message. """
+        from google.protobuf.message import DecodeError
+
+        message = LocalServerInfo_pb2.LocalServerMessage()
+        try:
+            message.ParseFromString(data)
+        except DecodeError as e:
+            raise MessageDecodeError(str(e)) from e
+
+        return message
+
+
+BACKENDS = {codec.name: codec for codec in (PurePythonCodec, ProtobufCodec)}
+
+_backend = None
+
+
+def _protobuf_available() -> bool:
+    try:
+        LocalServerInfo_pb2.LocalServerMessage
+    except (ImportError, TypeError):
+        # TypeError is raised by Protobuf runtimes too new for the generated module
+        return False
+
+    return True
+
+
+def set_backend(name: str) -> None:
+    """ Select the codec used for every message, 'protobuf' or 'python'. """
+    global _backend
+
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown codec backend {name!r}, expected one of {", ".join(BACKENDS)}')
+
+    _backend = BACKENDS[name]
+
+
+def get_backend():
+    """
+    The codec used for every message. Unless chosen with set_backend() or the ROBOVAC_CODEC environment variable,
+    the Protobuf runtime is used if it can load the generated module, falling back to the pure Python codec.
+    """
+    if _backend is None:
+        set_backend(os.environ.get('ROBOVAC_CODEC') or ('protobuf' if _protobuf_available() else 'python'))
+
+    return _backend
@@ -0,0 +1,169 @@
+import logging
+import random
+import socket
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+
+class ConnectionBackoffError(ConnectionError):
+    """ Exception raised when a connection is not attempted, as the backoff delay after a failed one has not passed """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ReconnectBackoff:
+    """ Exponential backoff with jitter between failed connection attempts. """
+
+    def __init__(self, initial=0.5, maximum=60.0, multiplier=2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.failures = 0
+
+    def next_delay(self) -> float:
+        """ Record a failed attempt and return how long to wait before the next one. """
+        delay = min(self.maximum, self.initial * self.multiplier ** self.failures)
+        self.failures += 1
+
+        # Jitter spreads out the reconnections of many clients that lost their connections at the same time
+        return random.uniform(delay / 2, delay)
+
+    def reset(self) -> None:
+        """ Record a successful attempt. """
+        self.failures = 0
+
+
+class RobovacConnection:
+    """
+    Owns the lifecycle of the socket to a single RoboVac.
+
+    The socket is connected lazily on first use, and a new socket is created for every reconnection. After a failed
+    attempt, further attempts fail fast until the backoff delay has passed, so a dropped network doesn't cause a
+    reconnection storm. Long-running processes should call maintain() periodically to close idle connections
+    and check the liveness of the others. Connecting and closing are safe to call from several threads.
+    """
+
+    def __init__(self,
+                 address: Tuple[str, int],
+                 idle_timeout: Optional[float] = None,
+                 keepalive_interval: Optional[float] = None,
+                 backoff: Optional[ReconnectBackoff] = None,
+                 on_connect: Optional[Callable[[], None]] = None):
+        """
+        :param idle_timeout: Seconds without any traffic after which maintain() closes the connection.
+        :param keepalive_interval: Seconds without any traffic after which maintain() checks the connection is alive.
+        :param on_connect: Called whenever a new socket has been connected.
+        """
+        self.address = address
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.backoff = backoff or ReconnectBackoff()
+        self.on_connect = on_connect
+        self.reconnects = 0
+        self._socket = None
+        self._last_used = 0.0
+        self._retry_at = 0.0
+        self._lock = threading.RLock()
+
+    @property
+    def connected(self) -> bool:
+        return self._socket is not None
+
+    def idle_time(self) -> float:
+        """ Seconds since the connection was last used. """
+        return time.monotonic() - self._last_used
+
+    def socket(self, timeout: Optional[float] = None) -> socket.socket:
+        """
+        Return the connected socket, connecting first if necessary.
+
+        :param timeout: Seconds to wait to connect. None waits as long as the operating system does.
+        """
+        with self._lock:
+            if self._socket is None:
+                self.connect(timeout)
+
+            self._last_used = time.monotonic()
+            return self._socket
+
+    def connect(self, timeout: Optional[float] = None) -> None:
+        """
+        Connect a new socket to the RoboVac, closing any existing one.
+
+        :param timeout: Seconds to wait to connect. Sending on the socket is limited to the same time.
+        :raises socket.timeout: If the RoboVac did not accept the connection in time.
+        :raises ConnectionBackoffError: If the backoff delay after a failed attempt has not passed yet.
+        """
+        with self._lock:
+            self.close()
+
+            now = time.monotonic()
+            if now < self._retry_at:
+                retry_after = self._retry_at - now
+                raise ConnectionBackoffError(f'Not connecting to {self.address[0]}:{self.address[1]} for another '
+                                             f'{retry_after:.1f}s after a failed attempt', retry_after)
+
+            try:
+                self._socket = socket.create_connection(self.address, timeout)
+            except OSError:
+                self._retry_at = now + self.backoff.next_delay()
+                raise
+
+            # Packets are tiny and often sent back to back without a reply in between, e.g. a command then a ping.
+            # With Nagle's algorithm, the second would wait for the RoboVac's delayed ACK of the first.
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            self.backoff.reset()
+            self._last_used = now
+
+            if self.on_connect is not None:
+                self.on_connect()
+
+    def reconnect(self, timeout: Optional[float] = None) -> None:
+        """ Replace the current socket with a newly connected one. """
+        self.reconnects += 1
+        self.connect(timeout)
+
+    def close(self, sock=None) -> None:
+        """
+        Close the socket, if connected. It will be reconnected on next use.
+
+        :param sock: If given, the connection is only closed if it is still using this socket.
+        """
+        with self._lock:
+            if self._socket is None or (sock is not None and sock is not self._socket):
+                return
+
+            try:
+                # Unlike close(), shutdown() wakes any thread blocked reading the socket
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+            try:
+                self._socket.close()
+            except OSError as e:
+                logging.exception(e)
+
+            self._socket = None
+
+    def maintain(self, health_check: Callable[[], bool]) -> None:
+        """
+        Close the connection if it has been idle for too long, or check that it is still alive if it has been
+        quiet for a while. A connection failing its health check is closed, to be reconnected on next use.
+
+        :param health_check: Exchanges a packet with the RoboVac, returning false if that failed.
+        """
+        if self._socket is None:
+            return
+
+        idle_time = self.idle_time()
+
+        if self.idle_timeout is not None and idle_time >= self.idle_timeout:
+            self.close()
+        elif self.keepalive_interval is not None and idle_time >= self.keepalive_interval:
+            if not health_check():
+                self.close()
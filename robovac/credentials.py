@@ -0,0 +1,147 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+from robovac.cloud import EufyCloudClient
+
+_FORMAT_VERSION = 1
+
+
+class CachedLocalCode(NamedTuple):
+    """ The local code of a RoboVac, with the IP address it was last seen at. """
+
+    device_id: Optional[str]
+    ip: str
+    local_code: str
+    updated_at: float
+
+
+class LocalCodeCache:
+    """
+    Local codes of RoboVacs kept in a file, so a restarted service can connect without the Eufy cloud.
+
+    Entries are found by device id or IP address. If an EufyCloudClient is given, missing and invalidated entries
+    are refreshed from a single device listing, which also updates every other entry. The file is rewritten
+    atomically on every change and is only readable by its owner, as local codes are credentials.
+    """
+
+    def __init__(self, path: str, cloud_client: Optional[EufyCloudClient] = None):
+        self.path = path
+        self.cloud_client = cloud_client
+        self._entries = {}  # type: Dict[str, CachedLocalCode]
+        self._lock = threading.RLock()
+        self.load()
+
+    def __len__(self) -> int:
+        """ The number of devices cached. Devices with an id are indexed twice, by IP address and by id. """
+        return len(set(self._entries.values()))
+
+    def load(self) -> None:
+        """ Read the entries from the file, if it exists. """
+        try:
+            with open(self.path) as f:
+                contents = json.load(f)
+        except FileNotFoundError:
+            return
+
+        if contents.get('version') != _FORMAT_VERSION:
+            return
+
+        with self._lock:
+            self._entries = {}
+            for fields in contents['devices']:
+                self._store(CachedLocalCode(*fields))
+
+    def save(self) -> None:
+        """ Write the entries to the file, replacing it atomically. """
+        with self._lock:
+            devices = sorted({entry for entry in self._entries.values()}, key=lambda entry: entry.ip)
+            contents = json.dumps({'version': _FORMAT_VERSION, 'devices': [list(entry) for entry in devices]},
+                                  separators=(',', ':'))
+
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, temporary_path = tempfile.mkstemp(dir=directory, prefix='.robovac-')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(contents)
+                os.chmod(temporary_path, 0o600)
+                os.replace(temporary_path, self.path)
+            except BaseException:
+                os.unlink(temporary_path)
+                raise
+
+    def get(self, ip: str = None, device_id: str = None) -> Optional[CachedLocalCode]:
+        """ The cached entry for a device, without any network I/O. """
+        return self._entries.get(self._key(ip, device_id))
+
+    def put(self, ip: str, local_code: str, device_id: str = None) -> CachedLocalCode:
+        """ Cache the local code of a device. """
+        entry = CachedLocalCode(device_id, ip, local_code, time.time())
+
+        with self._lock:
+            self._remove(ip=ip, device_id=device_id)
+            self._store(entry)
+            self.save()
+
+        return entry
+
+    def invalidate(self, ip: str = None, device_id: str = None) -> None:
+        """ Forget the local code of a device, e.g. because the RoboVac rejected it. """
+        with self._lock:
+            if self._remove(ip=ip, device_id=device_id):
+                self.save()
+
+    def lookup(self, ip: str = None, device_id: str = None) -> CachedLocalCode:
+        """ The cached entry for a device, refreshing it from the Eufy cloud if it is missing. """
+        entry = self.get(ip, device_id)
+        if entry is None:
+            entry = self.refresh(ip, device_id)
+
+        return entry
+
+    def refresh(self, ip: str = None, device_id: str = None) -> CachedLocalCode:
+        """ Fetch every device from the Eufy cloud, update the cache and return the entry for the given device. """
+        if self.cloud_client is None:
+            raise KeyError(f'No local code is cached for {self._key(ip, device_id)} and there is no cloud client')
+
+        devices = self.cloud_client.devices(refresh=True)
+        updated_at = time.time()
+
+        with self._lock:
+            for device in devices:
+                if device.ip and device.local_code:
+                    self._remove(ip=device.ip, device_id=device.id)
+                    self._store(CachedLocalCode(device.id, device.ip, device.local_code, updated_at))
+            self.save()
+
+        entry = self.get(ip, device_id)
+        if entry is None:
+            raise KeyError(f'The Eufy cloud has no device {self._key(ip, device_id)}')
+
+        return entry
+
+    @staticmethod
+    def _key(ip: Optional[str], device_id: Optional[str]) -> str:
+        if device_id is not None:
+            return f'id:{device_id}'
+        if ip is not None:
+            return f'ip:{ip}'
+
+        raise ValueError('An IP address or device id is required')
+
+    def _store(self, entry: CachedLocalCode) -> None:
+        self._entries[f'ip:{entry.ip}'] = entry
+        if entry.device_id is not None:
+            self._entries[f'id:{entry.device_id}'] = entry
+
+    def _remove(self, ip: str = None, device_id: str = None) -> bool:
+        """ Remove the entries for the device with the given IP address or id, returning true if any were found. """
+        entries = {self._entries.get(f'ip:{ip}'), self._entries.get(f'id:{device_id}')} - {None}
+        for entry in entries:
+            self._entries.pop(f'ip:{entry.ip}', None)
+            self._entries.pop(f'id:{entry.device_id}', None)
+
+        return bool(entries)
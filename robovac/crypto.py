@@ -0,0 +1,84 @@
+from functools import lru_cache
+from typing import Iterable, List
+
+BLOCK_SIZE = 16
+
+_AES_KEY = bytes([0x24, 0x4E, 0x6D, 0x8A, 0x56, 0xAC, 0x87, 0x91, 0x24, 0x43, 0x2D, 0x8B, 0x6C, 0xBC, 0xA2, 0xC4])
+_AES_IV = bytes([0x77, 0x24, 0x56, 0xF2, 0xA7, 0x66, 0x4C, 0xF3, 0x39, 0x2C, 0x35, 0x97, 0xE9, 0x3E, 0x57, 0x47])
+_AES_IV_INT = int.from_bytes(_AES_IV, 'big')
+_PADDING = bytes(BLOCK_SIZE)
+
+
+# Every packet is encrypted on its own with the same key and IV. Creating a CBC cipher per packet costs more than
+# encrypting the packet itself, so a single stateless ECB cipher is shared and the CBC chaining is applied here.
+@lru_cache(maxsize=None)
+def _ecb_cipher():
+    """ The shared cipher, created on first use as importing pycryptodome is slow. """
+    from Crypto.Cipher import AES
+    return AES.new(_AES_KEY, AES.MODE_ECB)
+
+
+def padded_size(length: int) -> int:
+    """ Size of a packet of the given length once padded. At least one byte of padding is always added. """
+    return (length // BLOCK_SIZE + 1) * BLOCK_SIZE
+
+
+def encrypt(data: bytes) -> bytes:
+    """ Encrypt data using the Eufy AES key and IV. Handles padding to a 16 byte interval. """
+    length = len(data)
+    size = padded_size(length)
+    data = bytes(data) + _PADDING[:size - length]
+
+    cipher = _ecb_cipher()
+    encrypted_blocks = []
+    previous = _AES_IV_INT
+    for offset in range(0, size, BLOCK_SIZE):
+        block = int.from_bytes(data[offset:offset + BLOCK_SIZE], 'big') ^ previous
+        encrypted_block = cipher.encrypt(block.to_bytes(BLOCK_SIZE, 'big'))
+        encrypted_blocks.append(encrypted_block)
+        previous = int.from_bytes(encrypted_block, 'big')
+
+    return b''.join(encrypted_blocks)
+
+
+def encrypt_batch(packets: Iterable[bytes]) -> List[bytes]:
+    """
+    Encrypt many packets at once.
+
+    CBC chaining is sequential within a packet but independent between packets, so the n-th block of every packet
+    is encrypted in a single call to the cipher.
+    """
+    padded_packets = [bytes(packet) + _PADDING[:padded_size(len(packet)) - len(packet)] for packet in packets]
+    encrypted_packets = [[] for _ in padded_packets]
+    previous_blocks = [_AES_IV] * len(padded_packets)
+    offset = 0
+
+    while True:
+        active = [i for i, packet in enumerate(padded_packets) if len(packet) > offset]
+        if not active:
+            break
+
+        blocks = b''.join(padded_packets[i][offset:offset + BLOCK_SIZE] for i in active)
+        chained = int.from_bytes(blocks, 'big') ^ int.from_bytes(b''.join(previous_blocks[i] for i in active), 'big')
+        encrypted_blocks = _ecb_cipher().encrypt(chained.to_bytes(len(blocks), 'big'))
+
+        for position, i in enumerate(active):
+            encrypted_block = encrypted_blocks[position * BLOCK_SIZE:(position + 1) * BLOCK_SIZE]
+            encrypted_packets[i].append(encrypted_block)
+            previous_blocks[i] = encrypted_block
+
+        offset += BLOCK_SIZE
+
+    return [b''.join(encrypted_blocks) for encrypted_blocks in encrypted_packets]
+
+
+def decrypt(data: bytes) -> bytes:
+    """ Decrypt data using the Eufy AES key and IV. """
+    length = len(data)
+    if length == 0:
+        return b''
+
+    # In CBC mode, each decrypted block is XORed with the previous ciphertext block (or the IV, for the first)
+    decrypted = int.from_bytes(_ecb_cipher().decrypt(data), 'big')
+    previous = (_AES_IV_INT << ((length - BLOCK_SIZE) * 8)) | int.from_bytes(data[:length - BLOCK_SIZE], 'big')
+    return (decrypted ^ previous).to_bytes(length, 'big')
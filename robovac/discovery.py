@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import ipaddress
+import time
+from typing import Iterable, List, NamedTuple, Optional, Set, Union
+
+from robovac.robovac import (
+    FrameReader,
+    RobovacConnectionClosedError,
+    RobovacProtocolError,
+    _build_ping_packet,
+    _encrypt,
+)
+
+
+class DiscoveredRobovac(NamedTuple):
+    """ A host accepting connections on the RoboVac port. """
+
+    ip: str
+    port: int
+    # The local code the RoboVac replied to, if any
+    local_code: Optional[str]
+    # True if the host replied to the encrypted ping handshake, so is certainly a RoboVac
+    confirmed: bool
+    round_trip: Optional[float]
+
+
+def _hosts(hosts: Union[str, Iterable[str]]) -> List[str]:
+    """ Expand a subnet such as '192.168.1.0/24' into its host addresses. Lists of addresses are used as they are. """
+    if isinstance(hosts, str):
+        return [str(host) for host in ipaddress.ip_network(hosts, strict=False).hosts()]
+
+    return list(hosts)
+
+
+async def _read_message(reader: asyncio.StreamReader):
+    frames = FrameReader()
+
+    while True:
+        data = await reader.read(4096)
+        if not data:
+            raise RobovacConnectionClosedError('The RoboVac closed the connection')
+
+        messages = frames.feed(data)
+        if messages:
+            return messages[0]
+
+
+async def _ping(host: str, port: int, local_code: str, timeout: float) -> Optional[float]:
+    """
+    Connect and send a ping with the given local code.
+
+    :return: The round trip time of the ping, or None if the host did not reply with a pong.
+    :raises OSError: If the connection could not be made.
+    """
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+
+    try:
+        started_at = time.perf_counter()
+        writer.write(_encrypt(_build_ping_packet(local_code)))
+        reply = await asyncio.wait_for(_read_message(reader), timeout)
+    except (OSError, asyncio.TimeoutError, RobovacProtocolError):
+        return None
+    finally:
+        writer.close()
+
+    return time.perf_counter() - started_at if reply.WhichOneof('playload') == 'a' else None
+
+
+async def discover(hosts: Union[str, Iterable[str]],
+                   local_codes: Iterable[str] = (),
+                   port=55556,
+                   max_concurrency=256,
+                   timeout=0.5) -> List[DiscoveredRobovac]:
+    """
+    Scan hosts for RoboVacs, e.g. to find RoboVacs whose IP addresses have changed.
+
+    Every host accepting connections on the RoboVac port is pinged with each of the given local codes in turn, until
+    one is accepted. A RoboVac refuses pings carrying another RoboVac's local code, so this also finds which RoboVac
+    is at which address. Local codes already matched to a host are not tried on the others.
+
+    :param hosts: A subnet such as '192.168.1.0/24', or a list of addresses.
+    :param local_codes: Local codes of the RoboVacs being looked for. Without any, hosts are pinged with an empty local
+        code and are only confirmed if they reply regardless.
+    :param max_concurrency: Maximum number of hosts probed at once.
+    :param timeout: Seconds to wait to connect, and then for each reply.
+    :return: Every host accepting connections on the port, in the order given. Check `confirmed` to tell RoboVacs
+        from hosts which refused every local code.
+    """
+    local_codes = list(local_codes) or ['']
+    matched = set()  # type: Set[str]
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def probe(host: str) -> Optional[DiscoveredRobovac]:
+        async with semaphore:
+            for local_code in local_codes:
+                if local_code in matched:
+                    continue
+
+                try:
+                    round_trip = await _ping(host, port, local_code, timeout)
+                except (OSError, asyncio.TimeoutError):
+                    # Nothing is listening
+                    return None
+
+                if round_trip is not None:
+                    matched.add(local_code)
+                    return DiscoveredRobovac(host, port, local_code or None, True, round_trip)
+
+            return DiscoveredRobovac(host, port, None, False, None)
+
+    results = await asyncio.gather(*(probe(host) for host in _hosts(hosts)))
+    return [result for result in results if result is not None]
+
+
+def discover_sync(hosts: Union[str, Iterable[str]],
+                  local_codes: Iterable[str] = (),
+                  **kwargs) -> List[DiscoveredRobovac]:
+    """ Blocking version of discover(), for use outside an event loop. """
+    return asyncio.run(discover(hosts, local_codes, **kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find RoboVacs on the local network.')
+    parser.add_argument('hosts', nargs='+', help='Subnet, e.g. 192.168.1.0/24, or list of addresses to scan')
+    parser.add_argument('--local-code', action='append', default=[], help='Local code to try. May be repeated')
+    parser.add_argument('--port', type=int, default=55556)
+    parser.add_argument('--max-concurrency', type=int, default=256)
+    parser.add_argument('--timeout', type=float, default=0.5)
+    args = parser.parse_args()
+
+    hosts = args.hosts[0] if len(args.hosts) == 1 and '/' in args.hosts[0] else args.hosts
+    started_at = time.perf_counter()
+    robovacs = discover_sync(hosts, args.local_code, port=args.port, max_concurrency=args.max_concurrency,
+                             timeout=args.timeout)
+
+    for robovac in robovacs:
+        if robovac.confirmed:
+            print(f'{robovac.ip}:{robovac.port} {robovac.local_code or ""} ({robovac.round_trip * 1e3:.1f} ms)')
+        else:
+            print(f'{robovac.ip}:{robovac.port} unconfirmed: refused every local code')
+
+    print(f'Scanned in {time.perf_counter() - started_at:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from robovac.aio import AsyncRobovac
+from robovac.metrics import MetricsRegistry
+from robovac.robovac import RobovacStatus, RobovacTimeoutError
+
+
+async def _call(robovac: AsyncRobovac,
+                method: str,
+                args: tuple,
+                kwargs: dict,
+                semaphore: asyncio.Semaphore,
+                deadline: Optional[float]) -> Union[object, Exception]:
+    """ Call a method on one RoboVac of a fleet once a slot is free, returning any exception in place of a result. """
+    async def call_in_slot():
+        async with semaphore:
+            return await getattr(robovac, method)(*args, **kwargs)
+
+    try:
+        return await asyncio.wait_for(call_in_slot(), deadline)
+    except RobovacTimeoutError as e:
+        return e
+    except asyncio.TimeoutError:
+        # The operation may have been cut off mid-exchange, so its reply must not be read by the next one
+        await robovac.disconnect()
+        return RobovacTimeoutError(f'The RoboVac at {robovac.ip} did not finish within the fleet deadline')
+    except Exception as e:
+        return e
+
+
+class RobovacFleet:
+    """
+    Many RoboVacs driven concurrently from a single event loop.
+
+    Connections to every RoboVac are kept open between sweeps. At most max_concurrency operations are in flight
+    at once, so a full sweep takes roughly as long as the slowest batch of devices rather than the sum of them all.
+    Failures are returned in place of results, so one unreachable RoboVac never fails the whole sweep. Every
+    operation has a timeout, so an unresponsive RoboVac gives up its slot to the rest of the fleet once it expires.
+    """
+
+    def __init__(self,
+                 devices: Iterable[Tuple[str, str]],
+                 max_concurrency=64,
+                 port=55556,
+                 timeout=10.0,
+                 predict_magic_numbers=False,
+                 metrics: MetricsRegistry = None,
+                 connect_timeout=5.0):
+        """
+        :param devices: (ip, local_code) pairs for every RoboVac in the fleet.
+        :param max_concurrency: Maximum number of RoboVacs communicated with at the same time.
+        :param timeout: Default timeout of each operation on each RoboVac.
+        :param metrics: Registry shared by every RoboVac in the fleet, aggregating their latencies and counters.
+        :param connect_timeout: Maximum seconds for each connection attempt to each RoboVac.
+        """
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.robovacs = {
+            ip: AsyncRobovac(ip, local_code, port, timeout, predict_magic_numbers, self.metrics, connect_timeout)
+            for ip, local_code in devices
+        }
+
+    def __len__(self) -> int:
+        return len(self.robovacs)
+
+    async def connect(self, timeout=None, deadline=None) -> Dict[str, Union[None, Exception]]:
+        """ Connect to every RoboVac in the fleet. """
+        return await self.call('connect', timeout=timeout, deadline=deadline)
+
+    async def disconnect(self) -> None:
+        """ Disconnect from every RoboVac in the fleet. """
+        await asyncio.gather(*(robovac.disconnect() for robovac in self.robovacs.values()))
+
+    async def get_status(self, timeout=None, deadline=None) -> Dict[str, Union[RobovacStatus, Exception]]:
+        """ Poll the status of every RoboVac in the fleet, returning a mapping of IP to status or error. """
+        return await self.call('get_status', timeout=timeout, deadline=deadline)
+
+    async def call(self, method: str, *args, deadline: float = None, **kwargs) -> Dict[str, Union[object, Exception]]:
+        """
+        Call an AsyncRobovac method, e.g. 'go_home', on every RoboVac in the fleet.
+
+        :param deadline: Seconds allowed for the whole sweep. RoboVacs not finished by then, including any still
+            waiting for a slot, fail with RobovacTimeoutError.
+        :return: Mapping of IP to the method's result, or the exception it raised.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*(_call(robovac, method, args, kwargs, semaphore, deadline)
+                                         for robovac in self.robovacs.values()))
+        return dict(zip(self.robovacs, results))
@@ -0,0 +1,77 @@
+import threading
+from typing import Optional
+
+
+class MagicNumberSequencer:
+    """
+    Tracks the magic numbers expected by the RoboVac, so that a ping round trip is only needed to synchronise.
+
+    Every packet sent to the RoboVac carries a magic number one greater than the last one it handed out. The
+    sequencer learns the current number from a ping response and predicts the following numbers locally.
+    If the RoboVac rejects or ignores a packet, the sequencer should be invalidated so the next packet pings again.
+    Every method is atomic, so threads sharing a connection are never handed the same magic number.
+    """
+
+    def __init__(self, predict=True):
+        self.predict = predict
+        self.pings_sent = 0
+        self.pings_saved = 0
+        self.resyncs = 0
+        self._next_magic_number = None
+        self._lock = threading.Lock()
+
+    @property
+    def synchronised(self) -> bool:
+        """ True if the next magic number can be predicted without a ping. """
+        return self.predict and self._next_magic_number is not None
+
+    def take(self) -> Optional[int]:
+        """ Return the next predicted magic number, or None if a ping is needed first. """
+        with self._lock:
+            if not self.synchronised:
+                return None
+
+            magic_number = self._next_magic_number
+            self._next_magic_number += 1
+            self.pings_saved += 1
+            return magic_number
+
+    def synchronise(self, pong_magic_number: int) -> int:
+        """ Record the magic number from a ping response and return the magic number to use next. """
+        with self._lock:
+            self.pings_sent += 1
+            self._next_magic_number = pong_magic_number + 2
+        return pong_magic_number + 1
+
+    def record_pong(self, pong_magic_number: int) -> None:
+        """ Record the magic number from a ping response which no packet followed, so the next packet uses it. """
+        with self._lock:
+            self.pings_sent += 1
+            self._next_magic_number = pong_magic_number + 1
+
+    def advance(self, count: int) -> None:
+        """ Record that the magic numbers following the last one taken were used without a ping, e.g. by a batch. """
+        with self._lock:
+            self.pings_saved += count
+            if self._next_magic_number is not None:
+                self._next_magic_number += count
+
+    def observe(self, magic_number: int) -> None:
+        """
+        Record the magic number carried by any other response from the RoboVac. The prediction never moves backwards,
+        as the reply to one packet may arrive after later packets have been sent.
+        """
+        with self._lock:
+            if self._next_magic_number is not None:
+                self._next_magic_number = max(self._next_magic_number, magic_number + 1)
+
+    def invalidate(self) -> None:
+        """ Forget the predicted magic number, forcing a ping before the next packet. """
+        with self._lock:
+            if self._next_magic_number is not None:
+                self.resyncs += 1
+                self._next_magic_number = None
+
+    def stats(self) -> dict:
+        """ Counters describing how many pings have been sent and saved. """
+        return {'pings_sent': self.pings_sent, 'pings_saved': self.pings_saved, 'resyncs': self.resyncs}
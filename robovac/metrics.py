@@ -0,0 +1,126 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence
+
+# Latency buckets in seconds, from fast LAN round trips up to a RoboVac that has stopped responding
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTERS = (
+    'bytes_sent',
+    'bytes_received',
+    'connects',
+    'reconnects',
+    'send_errors',
+    'protocol_errors',
+    'timeouts',
+)
+
+Hook = Callable[[str, float, Dict[str, str]], None]
+
+
+class Histogram:
+    """ Counts of observed values in fixed buckets, with their sum. """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        """ Number of values less than or equal to each bucket, ending with the total for +Inf. """
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+
+        return cumulative
+
+
+class MetricsRegistry:
+    """
+    Latency histograms per operation (ping, command, status) and counters for a RoboVac client.
+
+    A registry can be shared by many clients to aggregate a whole fleet. Hooks are called with
+    (name, value, labels) for every observation, e.g. to forward them to another metrics system.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.histograms = {}  # type: Dict[str, Histogram]
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._hooks = []  # type: List[Hook]
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Hook) -> None:
+        """ Call the hook for every latency observation and counter increment. """
+        self._hooks.append(hook)
+
+    def observe(self, operation: str, seconds: float) -> None:
+        """ Record the latency of an operation. """
+        with self._lock:
+            if operation not in self.histograms:
+                self.histograms[operation] = Histogram(self.buckets)
+            self.histograms[operation].observe(seconds)
+
+        for hook in self._hooks:
+            hook('operation_duration_seconds', seconds, {'operation': operation})
+
+    def increment(self, counter: str, amount=1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+        for hook in self._hooks:
+            hook(counter, amount, {})
+
+    @contextmanager
+    def timer(self, operation: str):
+        """ Record the latency of the enclosed block, if it completes without raising. """
+        started_at = time.perf_counter()
+        yield
+        self.observe(operation, time.perf_counter() - started_at)
+
+    def snapshot(self) -> dict:
+        """ A copy of every counter and histogram, as plain dicts. """
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'operations': {
+                    operation: {
+                        'count': histogram.count,
+                        'sum': histogram.sum,
+                        'buckets': dict(zip(self.buckets + (float('inf'),), histogram.cumulative_counts())),
+                    }
+                    for operation, histogram in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self, prefix='robovac') -> str:
+        """ Render every metric in the Prometheus text exposition format. """
+        lines = []
+
+        with self._lock:
+            for counter, value in self.counters.items():
+                lines.append(f'# TYPE {prefix}_{counter}_total counter')
+                lines.append(f'{prefix}_{counter}_total {value}')
+
+            name = f'{prefix}_operation_duration_seconds'
+            lines.append(f'# TYPE {name} histogram')
+
+            for operation, histogram in sorted(self.histograms.items()):
+                bounds = [repr(bucket) for bucket in self.buckets] + ['+Inf']
+                for bound, count in zip(bounds, histogram.cumulative_counts()):
+                    lines.append(f'{name}_bucket{{operation="{operation}",le="{bound}"}} {count}')
+
+                lines.append(f'{name}_sum{{operation="{operation}"}} {histogram.sum!r}')
+                lines.append(f'{name}_count{{operation="{operation}"}} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,190 @@
+import asyncio
+from typing import AsyncIterator, Dict, NamedTuple, Optional, Set, Union
+
+from robovac.aio import AsyncRobovac
+from robovac.fleet import RobovacFleet
+from robovac.robovac import RobovacChargerStatuses, RobovacErrorCodes, RobovacStatus, RobovacStatusModes
+from robovac.scheduler import TokenBucket
+
+
+class PollingPolicy:
+    """
+    Chooses how long to wait before polling a RoboVac again, from the last status it reported.
+
+    A RoboVac reporting an error is polled most often, then one cleaning, returning home or stranded off the dock with
+    a low battery. A docked RoboVac is polled at charging_interval until it is fully charged. Idle RoboVacs start at
+    idle_interval and back off, doubling the interval up to max_interval for as long as their status stays the same.
+    RoboVacs which cannot be reached back off in the same way from retry_interval.
+    """
+
+    def __init__(self,
+                 fault_interval=2.0,
+                 active_interval=5.0,
+                 charging_interval=60.0,
+                 idle_interval=60.0,
+                 max_interval=900.0,
+                 retry_interval=10.0,
+                 low_battery=20):
+        """ :param low_battery: Battery percentage at or below which a RoboVac off the dock is treated as active. """
+        self.fault_interval = fault_interval
+        self.active_interval = active_interval
+        self.charging_interval = charging_interval
+        self.idle_interval = idle_interval
+        self.max_interval = max_interval
+        self.retry_interval = retry_interval
+        self.low_battery = low_battery
+
+    def interval(self,
+                 status: Union[RobovacStatus, Exception],
+                 previous_interval: Optional[float],
+                 changed: bool) -> float:
+        """
+        Seconds until the next poll of a RoboVac.
+
+        :param status: The status just polled, or the exception raised polling it.
+        :param previous_interval: The interval chosen after the previous poll, if any.
+        :param changed: Whether the status differs from the previous poll, or the RoboVac started or stopped failing.
+        """
+        if isinstance(status, Exception):
+            return self._back_off(self.retry_interval, previous_interval, changed)
+        if status.error_code != RobovacErrorCodes.NO_ERROR:
+            return self.fault_interval
+        if status.mode != RobovacStatusModes.STOPPED:
+            return self.active_interval
+
+        if status.charger_status == RobovacChargerStatuses.CHARGING:
+            if status.battery_capacity < 100:
+                return self.charging_interval
+        elif status.battery_capacity <= self.low_battery:
+            return self.active_interval
+
+        return self._back_off(self.idle_interval, previous_interval, changed)
+
+    def _back_off(self, interval: float, previous_interval: Optional[float], changed: bool) -> float:
+        if changed or previous_interval is None or previous_interval < interval:
+            return interval
+
+        return min(previous_interval * 2, self.max_interval)
+
+
+class StatusChange(NamedTuple):
+    """ A change in the status of a RoboVac, or the first failure to poll it. """
+
+    ip: str
+    # The status just polled, or the exception raised polling the RoboVac
+    status: Union[RobovacStatus, Exception]
+    # The last status successfully polled before this one, if any
+    previous: Optional[RobovacStatus]
+
+
+class AdaptivePoller:
+    """
+    Poll every RoboVac of a fleet as often as its state calls for, yielding only changes.
+
+    After each poll, the policy picks the interval until a RoboVac's next poll from the status it reported, so busy
+    or faulted RoboVacs are watched closely while docked, fully charged ones are rarely contacted. Every poll spends
+    from a single budget of requests per second. When more polls fall due than the budget allows, they are sent in
+    the order they fell due, so every RoboVac's interval stretches rather than some RoboVacs being starved.
+    """
+
+    def __init__(self,
+                 fleet: RobovacFleet,
+                 budget=10.0,
+                 burst: float = None,
+                 policy: PollingPolicy = None,
+                 timeout: float = None):
+        """
+        :param fleet: The RoboVacs to poll. Its max_concurrency also bounds the number of polls in flight.
+        :param budget: Maximum status requests per second, across the whole fleet.
+        :param burst: Number of requests which may be sent back to back after a quiet period. Defaults to one
+            second's budget.
+        :param policy: Chooses each RoboVac's poll interval. Defaults to a PollingPolicy with its default intervals.
+        :param timeout: Timeout of each status request. Defaults to the fleet's timeout.
+        """
+        self.fleet = fleet
+        self.bucket = TokenBucket(budget, burst if burst is not None else max(1.0, budget))
+        self.policy = policy if policy is not None else PollingPolicy()
+        self.timeout = timeout
+        self.polls = 0
+        self.changes_emitted = 0
+        self.statuses = {}  # type: Dict[str, RobovacStatus]
+        self.intervals = {}  # type: Dict[str, float]
+        self._failing = set()  # type: Set[str]
+
+    async def changes(self) -> AsyncIterator[StatusChange]:
+        """
+        Poll the fleet for as long as the iteration continues, yielding the first status of every RoboVac, then
+        each change. A RoboVac which cannot be reached is yielded once with the exception, then again once it replies.
+        """
+        changes = asyncio.Queue()  # type: asyncio.Queue
+        budget_lock = asyncio.Lock()
+        semaphore = asyncio.Semaphore(self.fleet.max_concurrency)
+        tasks = [asyncio.ensure_future(self._poll_forever(ip, changes, budget_lock, semaphore))
+                 for ip in self.fleet.robovacs]
+
+        try:
+            while True:
+                yield await changes.get()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def poll(self, ip: str) -> Optional[StatusChange]:
+        """
+        Poll a RoboVac once, outside the budget, and choose the interval until its next poll.
+
+        :return: The change, if the status differs from the last one polled or the RoboVac started or stopped failing.
+        """
+        robovac = self.fleet.robovacs[ip]  # type: AsyncRobovac
+        previous = self.statuses.get(ip)
+
+        try:
+            status = await robovac.get_status(self.timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status = e
+
+        self.polls += 1
+        if isinstance(status, Exception):
+            changed = ip not in self._failing
+            self._failing.add(ip)
+        else:
+            changed = status != previous or ip in self._failing
+            self._failing.discard(ip)
+            self.statuses[ip] = status
+
+        self.intervals[ip] = self.policy.interval(status, self.intervals.get(ip), changed)
+
+        if not changed:
+            self.fleet.metrics.increment('polls_unchanged')
+            return None
+
+        self.changes_emitted += 1
+        return StatusChange(ip, status, previous)
+
+    def stats(self) -> dict:
+        """ Counters of polls sent, changes found, and RoboVacs currently failing to reply. """
+        return {'polls': self.polls, 'changes': self.changes_emitted, 'failing': len(self._failing)}
+
+    async def _spend_budget(self, budget_lock: asyncio.Lock) -> None:
+        """ Wait for a request from the budget. Waiters are served in turn, so polls go in the order they fell due. """
+        async with budget_lock:
+            while not self.bucket.take():
+                await asyncio.sleep(self.bucket.delay())
+
+    async def _poll_forever(self,
+                            ip: str,
+                            changes: asyncio.Queue,
+                            budget_lock: asyncio.Lock,
+                            semaphore: asyncio.Semaphore) -> None:
+        while True:
+            await self._spend_budget(budget_lock)
+            async with semaphore:
+                change = await self.poll(ip)
+
+            if change is not None:
+                changes.put_nowait(change)
+
+            await asyncio.sleep(self.intervals[ip])
@@ -0,0 +1,189 @@
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, Iterator, Optional, Tuple
+
+from robovac.robovac import STATUS_SIZE, Robovac, RobovacError, RobovacStatus, decode_status_records
+
+# File header: magic, format version, record size. Padded so every record's timestamp is 8 byte aligned.
+_HEADER = struct.Struct('<8sHH4x')
+_MAGIC = b'RVSTATUS'
+_VERSION = 1
+
+# Record: a little-endian float64 Unix timestamp, then the raw status zero-padded to 16 bytes
+_STATUS_WIDTH = 16
+_RECORD = struct.Struct(f'<d{_STATUS_WIDTH}s')
+_STATUS_OFFSET = 8
+
+assert STATUS_SIZE <= _STATUS_WIDTH
+
+
+class StatusLogError(Exception):
+    """ Exception raised when a file is not a status log written by StatusLogWriter """
+
+
+def _check_header(header: bytes, path: str) -> None:
+    if len(header) < _HEADER.size:
+        raise StatusLogError(f'{path} is not a status log')
+
+    magic, version, record_size = _HEADER.unpack(header)
+    if magic != _MAGIC or version != _VERSION or record_size != _RECORD.size:
+        raise StatusLogError(f'{path} is not a version {_VERSION} status log')
+
+
+class StatusLogWriter:
+    """
+    Append timestamped raw statuses to a file of fixed-width records.
+
+    Records are only ever appended, and a partial record left by a crash is discarded on reopening, so the file
+    can be read while it is being written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a+b')
+
+        size = self._file.seek(0, os.SEEK_END)
+        if size == 0:
+            self._file.write(_HEADER.pack(_MAGIC, _VERSION, _RECORD.size))
+            self._file.flush()
+            return
+
+        self._file.seek(0)
+        _check_header(self._file.read(_HEADER.size), path)
+
+        partial = (size - _HEADER.size) % _RECORD.size
+        if partial:
+            self._file.truncate(size - partial)
+
+    def __enter__(self) -> 'StatusLogWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, raw_status: bytes, timestamp: Optional[float] = None) -> None:
+        """
+        Append a raw status, as returned by Robovac.get_raw_status(). The timestamp defaults to now.
+
+        :raises ValueError: If the raw status is too short to be decoded.
+        """
+        if len(raw_status) < STATUS_SIZE:
+            raise ValueError(f'A raw status is at least {STATUS_SIZE} bytes, but {len(raw_status)} were given')
+
+        self._file.write(_RECORD.pack(time.time() if timestamp is None else timestamp, raw_status[:_STATUS_WIDTH]))
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class StatusLogReader:
+    """
+    Read a status log through a read-only memory map, so records are only decoded when asked for.
+
+    Records can be streamed one by one, or decoded into columns: one array per field, each copied straight out of the
+    map with a strided slice. Only records complete when the reader was opened are visible.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            _check_header(f.read(_HEADER.size), path)
+            size = os.fstat(f.fileno()).st_size
+            self._length = (size - _HEADER.size) // _RECORD.size
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._length else None
+
+    def __enter__(self) -> 'StatusLogReader':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[Tuple[float, RobovacStatus]]:
+        return self.iter_records()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def iter_records(self, start=0, stop=None) -> Iterator[Tuple[float, RobovacStatus]]:
+        """ Yield (timestamp, status) for each record in the range, decoding them one at a time. """
+        for timestamp, raw_status in _RECORD.iter_unpack(self._records(start, stop)):
+            yield timestamp, RobovacStatus.from_bytes(raw_status)
+
+    def timestamps(self, start=0, stop=None) -> array:
+        """ The timestamps of the records in the range. """
+        timestamps = array('d')
+        records = self._records(start, stop)
+
+        if len(records):
+            # Every record is a whole number of doubles, with the timestamp first
+            timestamps.frombytes(records.cast('d')[::_RECORD.size // 8].tobytes())
+            if sys.byteorder == 'big':
+                timestamps.byteswap()
+
+        return timestamps
+
+    def columns(self, start=0, stop=None) -> Dict[str, array]:
+        """ The records in the range as columns: 'timestamp', then one unsigned byte array per RobovacStatus field. """
+        columns = {'timestamp': self.timestamps(start, stop)}
+        columns.update(decode_status_records(self._records(start, stop), _RECORD.size, _STATUS_OFFSET))
+        return columns
+
+    def _records(self, start: int, stop: Optional[int]) -> memoryview:
+        start, stop, _ = slice(start, stop).indices(self._length)
+        if self._map is None or start >= stop:
+            return memoryview(b'')
+
+        return memoryview(self._map)[_HEADER.size + start * _RECORD.size:_HEADER.size + stop * _RECORD.size]
+
+
+class StatusRecorder:
+    """ Poll a RoboVac's status at a fixed interval, appending it to a status log. """
+
+    def __init__(self, robovac: Robovac, log: StatusLogWriter, interval=60.0, only_changes=False):
+        """ :param only_changes: If true, a status is only recorded if it differs from the last one recorded. """
+        self.robovac = robovac
+        self.log = log
+        self.interval = interval
+        self.only_changes = only_changes
+        self._last_raw_status = None
+        self._stopped = threading.Event()
+
+    def record(self) -> bool:
+        """ Poll the status once, returning true if it was recorded. """
+        raw_status = self.robovac.get_raw_status()
+
+        if self.only_changes and raw_status == self._last_raw_status:
+            return False
+
+        self.log.append(raw_status)
+        self._last_raw_status = raw_status
+        return True
+
+    def run(self) -> None:
+        """ Record until stop() is called. Failed polls are logged and retried at the next interval. """
+        next_poll_at = time.monotonic()
+
+        while not self._stopped.is_set():
+            try:
+                self.record()
+            except (OSError, RobovacError) as e:
+                logging.warning('Could not record status of RoboVac at %s: %s', self.robovac.ip, e)
+
+            next_poll_at += self.interval
+            self._stopped.wait(max(0.0, next_poll_at - time.monotonic()))
+
+    def stop(self) -> None:
+        self._stopped.set()
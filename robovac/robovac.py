@@ -1,69 +1,95 @@
 import socket
-from robovac import LocalServerInfo_pb2
 import random
-from Crypto.Cipher import AES
-from typing import Union
+import threading
+import weakref
+from array import array
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 import struct
-from enum import Enum
-import requests
+from enum import Enum, IntEnum
+from contextlib import contextmanager
+from functools import lru_cache
+from types import MappingProxyType
 import logging
+import time
+from robovac import codec, crypto
+from robovac.cache import StatusCache
+from robovac.cloud import EufyApiError, EufyCloudClient
+from robovac.codec import MessageTemplate
+from robovac.connection import ConnectionBackoffError, RobovacConnection
+from robovac.credentials import LocalCodeCache
+from robovac.lazy import lazy_import
+from robovac.magic import MagicNumberSequencer
+from robovac.metrics import MetricsRegistry
 
+# Loaded on first use, keeping `import robovac` fast for short-lived processes
+LocalServerInfo_pb2 = lazy_import('robovac.LocalServerInfo_pb2')
 
-_AES_KEY = bytearray([0x24, 0x4E, 0x6D, 0x8A, 0x56, 0xAC, 0x87, 0x91, 0x24, 0x43, 0x2D, 0x8B, 0x6C, 0xBC, 0xA2, 0xC4])
-_AES_IV = bytearray([0x77, 0x24, 0x56, 0xF2, 0xA7, 0x66, 0x4C, 0xF3, 0x39, 0x2C, 0x35, 0x97, 0xE9, 0x3E, 0x57, 0x47])
 
+class RobovacError(Exception):
+    """ Exception raised when there's a problem communicating with a RoboVac """
 
-class EufyApiError(Exception):
-    """ Exception raised when there's a problem communicating with the Eufy API """
 
+class RobovacProtocolError(RobovacError):
+    """ Exception raised when the RoboVac sends a message that cannot be parsed """
 
-def get_local_code(username: str, password: str, ip_address: str):
-    """
-    Retrieve the local code for a device using the EufyHome account's username and password.
 
-    Based on a similar method in the google/python-lakeside project:
-    https://github.com/google/python-lakeside/blob/c3f2fef2ca35aac49d2271b436c144b1b059aa6a/lakeside/__init__.py#L30
-    """
-    client_id = 'eufyhome-app'
-    client_secret = 'GQCpr9dSp3uQpsOMgJ4xQ'
+class RobovacConnectionClosedError(RobovacError, ConnectionError):
+    """ Exception raised when the RoboVac closes the connection while a reply is expected """
+
+
+class RobovacAuthError(RobovacError):
+    """ Exception raised when the RoboVac refuses the local code, e.g. because it has changed """
+
 
-    login_payload = {'client_id': client_id, 'client_Secret': client_secret, 'email': username, 'password': password}
-    login_request = requests.post("https://home-api.eufylife.com/v1/user/email/login", json=login_payload)
+class RobovacTimeoutError(RobovacError, socket.timeout):
+    """ Exception raised when the RoboVac does not connect or reply in time """
 
-    if login_request.status_code != 200:
-        raise EufyApiError('Could not authenticate with Eufy API. Is your username and password correct?')
 
-    token = login_request.json()['access_token']
-    headers = {'token': token, 'category': 'Home'}
-    devices_request = requests.get('https://home-api.eufylife.com/v1/device/list/devices-and-groups', headers=headers)
+class RobovacBackoffError(RobovacError, ConnectionError):
+    """ Exception raised when reconnecting is held back, as a recent connection attempt to the RoboVac failed """
 
-    if devices_request.status_code != 200:
-        raise EufyApiError('Could not list devices from Eufy API.')
 
-    devices_from_api = devices_request.json()
+class Deadline:
+    """ The time by which an operation must finish, shared by every step of it. """
+
+    def __init__(self, timeout: Optional[float]):
+        """ :param timeout: Seconds from now, or None for no deadline. """
+        self.timeout = timeout
+        self.expires_at = None if timeout is None else time.monotonic() + timeout
+
+    def remaining(self, limit: Optional[float] = None) -> Optional[float]:
+        """
+        Seconds left until the deadline, capped at the limit of a single step. None if neither is set.
+
+        :raises RobovacTimeoutError: If the deadline has passed.
+        """
+        if self.expires_at is None:
+            return limit
+
+        remaining = self.expires_at - time.monotonic()
+        if remaining <= 0:
+            raise RobovacTimeoutError(f'Timed out after {self.timeout}s')
 
-    for item in devices_from_api['items']:
-        if 'device' in item and item['device']['wifi']['lan_ip_addr'] == ip_address:
-            return item['device']['local_code']
+        return remaining if limit is None else min(remaining, limit)
 
-    raise EufyApiError('Cannot find local code for device with given IP address. Check that the IP address is correct.')
 
+# Errors raised when a status response is missing or unusable, e.g. because the RoboVac rejected the magic number
+_STATUS_RESPONSE_ERRORS = (RobovacProtocolError, struct.error)
 
-def _encrypt(data):
-    """ Encrypt data using the Eufy AES key and IV. Handles padding to a 16 byte interval. """
-    cipher = AES.new(bytes(_AES_KEY), AES.MODE_CBC, bytes(_AES_IV))
 
-    # Pad to 16 bytes for AES CBC
-    for i in range(16 - (len(data) % 16)):
-        data += b'\0'
+def get_local_code(username: str, password: str, ip_address: str):
+    """
+    Retrieve the local code for a device using the EufyHome account's username and password.
 
-    return cipher.encrypt(data)
+    Use EufyCloudClient directly to look up many devices with a single login.
+    """
+    with EufyCloudClient(username, password) as client:
+        return client.get_local_code(ip_address)
 
 
-def _decrypt(data):
-    """ Decrypt data using the Eufy AES key and IV. """
-    cipher = AES.new(bytes(_AES_KEY), AES.MODE_CBC, bytes(_AES_IV))
-    return cipher.decrypt(data)
+_encrypt = crypto.encrypt
+_decrypt = crypto.decrypt
 
 
 def _build_robovac_command(mode, command):
@@ -105,232 +131,934 @@ class RobovacCommands(Enum):
     MOVE = 0x01
 
 
-class RobovacStatus:
-    """ Status reported by the RoboVac. """
+# The command payloads never change, so they are compiled once for every combination of mode and command
+_COMMAND_PAYLOADS = MappingProxyType({
+    (mode, command): _build_robovac_command(mode, command) for mode in RobovacModes for command in RobovacCommands
+})
 
-    def __init__(self,
-                 find_me,
-                 water_tank_status,
-                 mode,
-                 speed,
-                 charger_status,
-                 battery_capacity,
-                 error_code,
-                 stop):
-        self.find_me = find_me
-        self.water_tank_status = water_tank_status
-        self.mode = mode
-        self.speed = speed
-        self.charger_status = charger_status
-        self.battery_capacity = battery_capacity
-        self.error_code = error_code
-        self.stop = stop
+
+@lru_cache(maxsize=4096)
+def _ping_template(local_code: str) -> MessageTemplate:
+    return MessageTemplate(codec.get_backend().encode(localcode=local_code, ping_type=codec.PING_REQUEST))
+
+
+@lru_cache(maxsize=4096)
+def _command_template(local_code: str, mode: RobovacModes, command: RobovacCommands) -> MessageTemplate:
+    return MessageTemplate(codec.get_backend().encode(localcode=local_code,
+                                                      user_data_type=codec.SEND_USER_DATA_TO_DEVICE,
+                                                      usr_data=_COMMAND_PAYLOADS[mode, command]))
+
+
+@lru_cache(maxsize=4096)
+def _status_request_template(local_code: str) -> MessageTemplate:
+    return MessageTemplate(codec.get_backend().encode(localcode=local_code,
+                                                      user_data_type=codec.GET_DEVICE_STATUS_DATA))
+
+
+def _is_status_push(message: 'LocalServerInfo_pb2.LocalServerMessage') -> bool:
+    """ True if the message is a status update sent by the RoboVac unprompted, rather than a reply. """
+    return (message.WhichOneof('playload') == 'c'
+            and message.c.type == codec.SEND_STATUS_DATA_TO_APP)
+
+
+def _build_ping_packet(local_code: str) -> bytes:
+    """ Serialize a ping packet used to retrieve the next magic number. """
+    return _ping_template(local_code).render(random.randrange(3000000))
+
+
+class RobovacStatusModes(IntEnum):
+    """ Enum representations of the modes reported in the RoboVac's status. These match the WORK commands. """
+
+    STOPPED = 0x00
+    SPOT_CLEAN = 0x01
+    AUTO_CLEAN = 0x02
+    GOING_HOME = 0x03
+    EDGE_CLEAN = 0x04
+    SINGLE_ROOM_CLEAN = 0x05
+
+
+class RobovacChargerStatuses(IntEnum):
+    """ Enum representations of the charger statuses reported in the RoboVac's status. """
+
+    NOT_CHARGING = 0x00
+    CHARGING = 0x01
+
+
+class RobovacErrorCodes(IntEnum):
+    """ Enum representations of the error codes reported in the RoboVac's status. """
+
+    NO_ERROR = 0x00
+
+
+def _enum_lookup(enum_type) -> dict:
+    """ Map raw values to enum members. Values without a member are decoded as plain ints. """
+    return {member.value: member for member in enum_type}
+
+
+_STATUS_MODES = _enum_lookup(RobovacStatusModes)
+_CHARGER_STATUSES = _enum_lookup(RobovacChargerStatuses)
+_ERROR_CODES = _enum_lookup(RobovacErrorCodes)
+
+# Offsets of the status fields in the user data: 1 mode, 6 flags, 8 speed, 10 battery, 11 charger, 12 error, 13 stop
+_STATUS_STRUCT = struct.Struct('<xB4xBxBxBBBB')
+STATUS_SIZE = _STATUS_STRUCT.size
+_FIND_ME_FLAG = 0x04
+_WATER_TANK_FLAG = 0x02
+
+# Translation tables extracting a single flag bit from every byte of a bytes object at once
+_FIND_ME_TABLE = bytes(1 if value & _FIND_ME_FLAG else 0 for value in range(256))
+_WATER_TANK_TABLE = bytes(1 if value & _WATER_TANK_FLAG else 0 for value in range(256))
+
+
+class RobovacStatus(NamedTuple):
+    """ Status reported by the RoboVac. Immutable, and stored without a per-instance __dict__. """
+
+    find_me: int
+    water_tank_status: int
+    mode: Union[RobovacStatusModes, int]
+    speed: int
+    charger_status: Union[RobovacChargerStatuses, int]
+    battery_capacity: int
+    error_code: Union[RobovacErrorCodes, int]
+    stop: int
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'RobovacStatus':
+        """ Decode the user data of a status response, which may be a bytes object or a memoryview. """
+        mode, flags, speed, battery_capacity, charger_status, error_code, stop = _STATUS_STRUCT.unpack_from(data)
+
+        return cls(
+            1 if flags & _FIND_ME_FLAG else 0,
+            1 if flags & _WATER_TANK_FLAG else 0,
+            _STATUS_MODES.get(mode, mode),
+            speed,
+            _CHARGER_STATUSES.get(charger_status, charger_status),
+            battery_capacity,
+            _ERROR_CODES.get(error_code, error_code),
+            stop
+        )
 
     def __str__(self) -> str:
         return f'[FIND_ME: {self.find_me}, WATER_TANK: {self.water_tank_status}, MODE: {self.mode}, SPEED: {self.speed}, CHARGER_STATUS: {self.charger_status}, BATTERY_CAPACITY: {self.battery_capacity}, ERROR_CODE: {self.error_code}, STOP: {self.stop}]'
 
 
+def _status_usr_data(message: 'LocalServerInfo_pb2.LocalServerMessage') -> bytes:
+    """ The user data of a status reply, checked to be long enough to decode. """
+    usr_data = bytes(message.c.usr_data)
+    if len(usr_data) < STATUS_SIZE:
+        raise RobovacProtocolError(f'Status response of {len(usr_data)} bytes is too short')
+
+    return usr_data
+
+
+class CommandStepResult(NamedTuple):
+    """ Timing of a single command sent by Robovac.send_commands. """
+
+    mode: 'RobovacModes'
+    command: 'RobovacCommands'
+    magic_number: int
+    sent_after: float
+
+
+class CommandBatchResult(NamedTuple):
+    """ Result of Robovac.send_commands. Times are in seconds from the first command being sent. """
+
+    steps: List[CommandStepResult]
+    status: Union[None, RobovacStatus]
+    acknowledged_after: Union[None, float]
+
+
+def decode_status_columns(payloads: Iterable[bytes]) -> Dict[str, array]:
+    """
+    Decode many raw status payloads at once into columns, one unsigned byte array per RobovacStatus field.
+
+    Enum fields are left as their raw values. The payloads are joined into fixed-width records, and each column
+    is extracted with a single strided slice rather than decoding payloads one by one.
+    """
+    record_size = _STATUS_STRUCT.size
+    chunks = []
+    for payload in payloads:
+        if len(payload) < record_size:
+            raise ValueError(f'Every status payload must be at least {record_size} bytes, got {len(payload)}')
+        chunks.append(bytes(payload[:record_size]))
+
+    records = b''.join(chunks)
+    return decode_status_records(records, record_size)
+
+
+def decode_status_records(records, record_size: int, offset=0) -> Dict[str, array]:
+    """
+    Decode a buffer of fixed-width records into status columns, as decode_status_columns does.
+
+    :param records: A bytes-like object, e.g. a memoryview of a memory-mapped file. Only the columns are copied.
+    :param record_size: Size of each record, which must be at least offset plus STATUS_SIZE bytes.
+    :param offset: Offset of the raw status payload within each record.
+    """
+    records = memoryview(records)
+
+    def column(index: int) -> bytes:
+        return records[offset + index::record_size].tobytes()
+
+    flags = column(6)
+
+    return {
+        'find_me': array('B', flags.translate(_FIND_ME_TABLE)),
+        'water_tank_status': array('B', flags.translate(_WATER_TANK_TABLE)),
+        'mode': array('B', column(1)),
+        'speed': array('B', column(8)),
+        'charger_status': array('B', column(11)),
+        'battery_capacity': array('B', column(10)),
+        'error_code': array('B', column(12)),
+        'stop': array('B', column(13)),
+    }
+
+
+class FrameReader:
+    """
+    Reassemble the messages sent by the RoboVac from a stream of bytes.
+
+    Each message is a 2 byte little-endian length and a Protobuf Local Server Message, zero-padded to a whole
+    number of AES blocks and encrypted on its own. Bytes are received into a single reusable buffer, so messages
+    split across reads or coalesced into one read are handled without allocating a new buffer per packet.
+    """
+
+    def __init__(self, max_frame_size=4096):
+        self._buffer = bytearray(max_frame_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._frame_size = None
+        self.bytes_received = 0
+
+    def reset(self) -> None:
+        """ Discard any buffered bytes, e.g. after reconnecting. """
+        self._start = 0
+        self._end = 0
+        self._frame_size = None
+
+    def feed(self, data: bytes) -> List['LocalServerInfo_pb2.LocalServerMessage']:
+        """ Add bytes received from the RoboVac, returning every message that is now complete. """
+        messages = []
+        data = memoryview(data)
+        self.bytes_received += len(data)
+
+        while data:
+            self._compact()
+            chunk_size = min(len(data), len(self._buffer) - self._end)
+            self._buffer[self._end:self._end + chunk_size] = data[:chunk_size]
+            self._end += chunk_size
+            data = data[chunk_size:]
+
+            message = self._next_message()
+            while message is not None:
+                messages.append(message)
+                message = self._next_message()
+
+        return messages
+
+    def read_message(self, sock: socket.socket) -> 'LocalServerInfo_pb2.LocalServerMessage':
+        """
+        Read the next message from a blocking socket. Only the AES blocks making up that message are received,
+        so any following message is left unread on the socket.
+        """
+        message = self._next_message()
+
+        while message is None:
+            self._compact()
+            bytes_needed = self._bytes_needed()
+            received = sock.recv_into(self._view[self._end:self._end + bytes_needed], bytes_needed)
+
+            if received == 0:
+                raise RobovacConnectionClosedError('The RoboVac closed the connection')
+
+            self._end += received
+            self.bytes_received += received
+            message = self._next_message()
+
+        return message
+
+    def _bytes_needed(self) -> int:
+        buffered = self._end - self._start
+        if self._frame_size is None:
+            return crypto.BLOCK_SIZE - buffered
+
+        return self._frame_size - buffered
+
+    def _compact(self) -> None:
+        """ Move any partially received message to the start of the buffer. """
+        if self._start == 0:
+            return
+
+        buffered = self._end - self._start
+        self._buffer[:buffered] = self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = buffered
+
+    def _next_message(self) -> Union[None, 'LocalServerInfo_pb2.LocalServerMessage']:
+        """ Parse the next message from the buffer, or return None if it has not been fully received yet. """
+        buffered = self._end - self._start
+
+        if self._frame_size is None:
+            if buffered < crypto.BLOCK_SIZE:
+                return None
+
+            # The first block holds the length, which gives the number of blocks in the whole message
+            first_block = _decrypt(self._view[self._start:self._start + crypto.BLOCK_SIZE])
+            length = struct.unpack_from("<H", first_block)[0]
+            blocks = (length + 2 + crypto.BLOCK_SIZE - 1) // crypto.BLOCK_SIZE
+            self._frame_size = blocks * crypto.BLOCK_SIZE
+
+            if self._frame_size > len(self._buffer):
+                frame_size = self._frame_size
+                self.reset()
+                raise RobovacProtocolError(f'Message of {frame_size} bytes exceeds the maximum frame size')
+
+        if buffered < self._frame_size:
+            return None
+
+        decrypted_response = _decrypt(self._view[self._start:self._start + self._frame_size])
+        self._start += self._frame_size
+        self._frame_size = None
+
+        try:
+            return Robovac._parse_local_server_message_from_decrypted_response(decrypted_response)
+        except codec.MessageDecodeError as e:
+            raise RobovacProtocolError('Could not parse message from the RoboVac') from e
+
+
+def _shutdown_socket(sock: socket.socket) -> None:
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class PendingReply:
+    """ A reply expected from the RoboVac, handed over by the ReplyDispatcher reading its connection. """
+
+    __slots__ = ('dispatcher', 'magic_number', 'future')
+
+    def __init__(self, dispatcher: 'ReplyDispatcher', magic_number: Optional[int]):
+        self.dispatcher = dispatcher
+        self.magic_number = magic_number
+        self.future = Future()
+
+    def wait(self, timeout: Optional[float]) -> 'LocalServerInfo_pb2.LocalServerMessage':
+        """ Wait for the reply, for at most timeout seconds. """
+        try:
+            return self.future.result(timeout)
+        except FutureTimeoutError:
+            self.dispatcher.discard(self)
+            raise RobovacTimeoutError('Timed out waiting for a reply from the RoboVac') from None
+
+
+class ReplyDispatcher:
+    """
+    Read every message sent on a connection from a background thread, handing each reply to the request expecting it.
+
+    Requests register the reply they expect before sending, so a reply can never arrive unclaimed. The RoboVac
+    replies to packets in order, but the replies themselves are matched where they can be: pongs go to the oldest
+    ping, and status replies to the status request sent with the same magic number. Any other message goes to the
+    oldest request still waiting. Status updates pushed by the RoboVac are not replies, so are skipped.
+
+    The thread stops when the connection is closed, failing every request still waiting. A message which cannot be
+    parsed also closes the connection, as what follows it on the connection can no longer be trusted to start at a
+    message boundary.
+    """
+
+    def __init__(self, sock: socket.socket, metrics: MetricsRegistry, name: str):
+        self.sock = sock
+        self.metrics = metrics
+        self._frames = FrameReader()
+        self._waiting = []  # type: List[PendingReply]
+        self._lock = threading.Lock()
+        self._error = None  # type: Optional[BaseException]
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def closed(self) -> bool:
+        """ True once the connection has been closed, or has failed. """
+        return self._error is not None
+
+    def expect(self, magic_number: Optional[int] = None) -> PendingReply:
+        """
+        Register a reply expected to the packet about to be sent.
+
+        :param magic_number: The magic number of a status request, or None for a ping.
+        """
+        reply = PendingReply(self, magic_number)
+
+        with self._lock:
+            if self._error is not None:
+                reply.future.set_exception(self._error)
+            else:
+                self._waiting.append(reply)
+
+        return reply
+
+    def discard(self, reply: PendingReply) -> None:
+        """ Stop waiting for a reply, e.g. because the packet could not be sent. """
+        with self._lock:
+            if reply in self._waiting:
+                self._waiting.remove(reply)
+
+    def _run(self) -> None:
+        try:
+            while True:
+                bytes_received = self._frames.bytes_received
+                try:
+                    message = self._frames.read_message(self.sock)
+                except socket.timeout:
+                    # Waiting requests time out by themselves, and partial messages are kept for the next read
+                    continue
+                except RobovacProtocolError:
+                    # e.g. the rest of an oversized message is still unread, so every later read would parse garbage
+                    self.metrics.increment('protocol_errors')
+                    _shutdown_socket(self.sock)
+                    raise
+                finally:
+                    self.metrics.increment('bytes_received', self._frames.bytes_received - bytes_received)
+
+                if not _is_status_push(message):
+                    self._resolve(message)
+        except (OSError, RobovacProtocolError) as e:
+            error = e
+        except Exception as e:
+            logging.exception(e)
+            error = RobovacConnectionClosedError(f'Stopped reading from the RoboVac: {e}')
+
+        with self._lock:
+            self._error = error
+            waiting, self._waiting = self._waiting, []
+
+        for reply in waiting:
+            reply.future.set_exception(error)
+
+    def _resolve(self, message: 'LocalServerInfo_pb2.LocalServerMessage') -> None:
+        with self._lock:
+            reply = self._claim(message)
+
+        if reply is None:
+            logging.debug('Discarding a message from the RoboVac which no request is waiting for')
+        else:
+            reply.future.set_result(message)
+
+    def _claim(self, message: 'LocalServerInfo_pb2.LocalServerMessage') -> Optional[PendingReply]:
+        """ Remove and return the request a message replies to. Called with the lock held. """
+        if not self._waiting:
+            return None
+
+        payload = message.WhichOneof('playload')
+        if payload == 'a':
+            candidates = [reply for reply in self._waiting if reply.magic_number is None]
+        elif payload == 'c':
+            candidates = ([reply for reply in self._waiting if reply.magic_number == message.magic_num]
+                          or [reply for reply in self._waiting if reply.magic_number is not None])
+        else:
+            candidates = []
+
+        reply = candidates[0] if candidates else self._waiting[0]
+        self._waiting.remove(reply)
+        return reply
+
+
 class Robovac:
     @staticmethod
     def _parse_local_server_message_from_decrypted_response(decrypted_response):
-        """ Parse a decrypted response into a Protobuf Local Server Message """
+        """ Parse a decrypted response into a Local Server Message, using the selected codec backend """
 
         # First 2 bytes indicate length of the actual data
         length = struct.unpack("<H", decrypted_response[0:2])[0]
         protobuf_data = decrypted_response[2:length + 2]
 
-        message = LocalServerInfo_pb2.LocalServerMessage()
-        message.ParseFromString(protobuf_data)
-        return message
+        return codec.get_backend().decode(protobuf_data)
 
-    def __init__(self, ip: str, local_code: str, port=55556):
+    def __init__(self,
+                 ip: str,
+                 local_code: str,
+                 port=55556,
+                 predict_magic_numbers=False,
+                 idle_timeout=None,
+                 keepalive_interval=None,
+                 status_cache_ttl=None,
+                 metrics: MetricsRegistry = None,
+                 timeout=10.0,
+                 connect_timeout=5.0,
+                 read_timeout=None):
+        """
+        :param predict_magic_numbers: If true, magic numbers are predicted locally rather than pinging the RoboVac
+            before every packet. The RoboVac is only pinged again after a status request fails.
+        :param idle_timeout: Seconds without traffic after which keep_alive() closes the connection.
+        :param keepalive_interval: Seconds without traffic after which keep_alive() pings the RoboVac.
+        :param status_cache_ttl: If set, get_status() reuses a status for this many seconds, and concurrent calls
+            share a single request. Sending a command invalidates the cached status.
+        :param metrics: Registry recording latencies and counters. May be shared by many clients.
+        :param timeout: Default deadline in seconds for each operation, covering every connection attempt, packet and
+            reply it needs. Every public method accepts a timeout overriding it. None waits forever.
+        :param connect_timeout: Maximum seconds for each connection attempt.
+        :param read_timeout: Maximum seconds to wait for each reply.
+        """
         self.ip = ip
         self.port = port
         self.local_code = local_code
-        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.magic_numbers = MagicNumberSequencer(predict_magic_numbers)
+        self.connection = RobovacConnection((ip, port),
+                                            idle_timeout=idle_timeout,
+                                            keepalive_interval=keepalive_interval,
+                                            on_connect=self._on_connect)
+        self.status_cache = StatusCache(status_cache_ttl) if status_cache_ttl is not None else None
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # Held while magic numbers are handed out and their packets sent, so packets leave in magic number order
+        self._lock = threading.RLock()
+        self._dispatcher = None  # type: Optional[ReplyDispatcher]
+        self._dispatcher_finalizer = None  # type: Optional[weakref.finalize]
+        self._local_code_cache = None  # type: LocalCodeCache
+        self._device_id = None
+
+    @classmethod
+    def from_cache(cls, cache: LocalCodeCache, ip: str = None, device_id: str = None, **kwargs) -> 'Robovac':
+        """
+        Create a client using a local code cached on disk, without any network I/O if the RoboVac is cached.
 
-    def connect(self) -> None:
+        A RoboVac found by device id is connected to at the IP address it was last seen at. If the RoboVac refuses
+        the cached local code, the entry is refreshed from the cache's cloud client and the handshake is retried.
+        """
+        entry = cache.lookup(ip, device_id)
+        robovac = cls(entry.ip, entry.local_code, **kwargs)
+        robovac._local_code_cache = cache
+        robovac._device_id = entry.device_id
+        return robovac
+
+    @property
+    def s(self) -> socket.socket:
+        """ The socket connected to the RoboVac. Connects if there is no connection yet. """
+        return self.connection.socket()
+
+    def connect(self, timeout=None) -> None:
         """ Connect to the RoboVac at the given IP and port """
-        self.s.connect((self.ip, self.port))
+        deadline = self._deadline(timeout)
+
+        with self._locked(deadline):
+            self.disconnect()
+            self._connect(deadline)
 
     def disconnect(self) -> None:
-        """ Attempt to disconnect from the RoboVac. This will fail and log an error if no connection exists """
+        """ Disconnect from the RoboVac. It will be reconnected automatically when next used. """
+        self.connection.close()
+
+    def ping(self, timeout=None) -> bool:
+        """ Check that the RoboVac is reachable, returning false if it did not respond to a ping in time. """
+        return self._ping(self._deadline(timeout))
+
+    def _ping(self, deadline: Deadline) -> bool:
         try:
-            self.s.close()
-        except OSError as e:
-            logging.exception(e)
+            with self._locked(deadline), self.metrics.timer('ping'):
+                pong = self._send_packet(_build_ping_packet(self.local_code), True, deadline)
+                self.magic_numbers.record_pong(pong.magic_num)
+        except (OSError, RobovacError) as e:
+            logging.warning('Ping to RoboVac at %s failed: %s', self.ip, e)
+            return False
+
+        return True
+
+    def keep_alive(self, timeout=None) -> None:
+        """
+        Keep a long-lived connection healthy. Long-running processes should call this periodically: it closes the
+        connection once it has been idle for idle_timeout, and pings the RoboVac once the connection has been quiet
+        for keepalive_interval. Connections that fail the ping, or don't answer it in time, are closed, to be
+        reconnected on next use.
+
+        :raises RobovacTimeoutError: If other operations on the RoboVac held the client until the timeout.
+        """
+        deadline = self._deadline(timeout)
+        with self._locked(deadline):
+            self.connection.maintain(lambda: self._ping(deadline))
 
-    def get_status(self) -> RobovacStatus:
+    def _on_connect(self) -> None:
+        """ Reset per-connection protocol state whenever a new socket is connected. """
+        self.metrics.increment('connects')
+        self.magic_numbers.invalidate()
+
+    def get_status(self, timeout=None) -> RobovacStatus:
         """ Get the status of the RoboVac device (battery level, mode, charging, etc). """
-        message = self._build_get_device_status_user_data_message()
-        robovac_response = self._send_packet(message, True)
-        received_status_bytes = robovac_response.c.usr_data
-        received_status_ints = [x for x in received_status_bytes]
-
-        return RobovacStatus(
-            1 if received_status_ints[6] & 4 > 0 else 0,
-            1 if received_status_ints[6] & 2 > 0 else 0,
-            received_status_ints[1] & 255,
-            received_status_ints[8] & 255,
-            received_status_ints[11] & 255,
-            received_status_ints[10] & 255,
-            received_status_ints[12] & 255,
-            received_status_ints[13] & 255
-        )
+        deadline = self._deadline(timeout)
+        if self.status_cache is None:
+            return self._fetch_status(deadline)
 
-    def start_auto_clean(self):
-        """ Tell the RoboVac to start its auto-clean programme. """
-        command = _build_robovac_command(RobovacModes.WORK, RobovacCommands.AUTO_CLEAN)
-        message = self._build_command_user_data_message(command)
+        try:
+            return self.status_cache.get(lambda: self._fetch_status(deadline), deadline.remaining())
+        except RobovacTimeoutError:
+            raise
+        except FutureTimeoutError:
+            raise RobovacTimeoutError(f'Timed out waiting for the status of the RoboVac at {self.ip}') from None
 
-        self._send_packet(message, False)
+    def get_raw_status(self, timeout=None) -> bytes:
+        """
+        Get the status of the RoboVac as the raw bytes it sent, which RobovacStatus.from_bytes() decodes.
+        Bypasses the status cache.
+        """
+        return self._fetch_raw_status(self._deadline(timeout))
+
+    def _fetch_status(self, deadline: Deadline) -> RobovacStatus:
+        return RobovacStatus.from_bytes(self._fetch_raw_status(deadline))
+
+    def _fetch_raw_status(self, deadline: Deadline) -> bytes:
+        with self.metrics.timer('status'):
+            predicted = self.magic_numbers.synchronised
+
+            try:
+                return self._request_raw_status(deadline)
+            except _STATUS_RESPONSE_ERRORS:
+                if not predicted:
+                    raise
+
+            # The predicted magic number may have been rejected, so ping to resynchronise and try again
+            self.magic_numbers.invalidate()
+            return self._request_raw_status(deadline)
+
+    def _request_raw_status(self, deadline: Deadline) -> bytes:
+        with self._locked(deadline):
+            # The handshake may replace a refused local code, so the template is only chosen after it
+            magic_number = self._get_magic_number(deadline)
+            template = _status_request_template(self.local_code)
+            reply = self._transmit(_encrypt(template.render(magic_number)), True, deadline, magic_number)
+
+        # Other threads can send while this one waits for its reply
+        robovac_response = self._wait_for_reply(reply, deadline)
+        self.magic_numbers.observe(robovac_response.magic_num)
+        return _status_usr_data(robovac_response)
+
+    def start_auto_clean(self, timeout=None):
+        """ Tell the RoboVac to start its auto-clean programme. """
+        self._send_command(RobovacModes.WORK, RobovacCommands.AUTO_CLEAN, timeout)
 
-    def start_spot_clean(self):
+    def start_spot_clean(self, timeout=None):
         """ Tell the RoboVac to start its spot-clean programme. """
-        command = _build_robovac_command(RobovacModes.WORK, RobovacCommands.SPOT_CLEAN)
-        message = self._build_command_user_data_message(command)
-
-        self._send_packet(message, False)
+        self._send_command(RobovacModes.WORK, RobovacCommands.SPOT_CLEAN, timeout)
 
-    def start_edge_clean(self):
+    def start_edge_clean(self, timeout=None):
         """ Tell the RoboVac to start its edge-clean programme. """
-        command = _build_robovac_command(RobovacModes.WORK, RobovacCommands.EDGE_CLEAN)
-        message = self._build_command_user_data_message(command)
+        self._send_command(RobovacModes.WORK, RobovacCommands.EDGE_CLEAN, timeout)
 
-        self._send_packet(message, False)
-
-    def start_single_room_clean(self):
+    def start_single_room_clean(self, timeout=None):
         """ Tell the RoboVac to clean a single room. """
-        command = _build_robovac_command(RobovacModes.WORK, RobovacCommands.SINGLE_ROOM_CLEAN)
-        message = self._build_command_user_data_message(command)
-
-        self._send_packet(message, False)
+        self._send_command(RobovacModes.WORK, RobovacCommands.SINGLE_ROOM_CLEAN, timeout)
 
-    def stop(self):
+    def stop(self, timeout=None):
         """ Tell the RoboVac to stop cleaning. The RoboVac will not return to its charging base. """
-        command = _build_robovac_command(RobovacModes.WORK, RobovacCommands.STOP_CLEAN)
-        message = self._build_command_user_data_message(command)
+        self._send_command(RobovacModes.WORK, RobovacCommands.STOP_CLEAN, timeout)
 
-        self._send_packet(message, False)
-
-    def go_home(self):
+    def go_home(self, timeout=None):
         """ Tell the RoboVac to return to its charging base. """
-        command = _build_robovac_command(RobovacModes.WORK, RobovacCommands.GO_HOME)
-        message = self._build_command_user_data_message(command)
-
-        self._send_packet(message, False)
+        self._send_command(RobovacModes.WORK, RobovacCommands.GO_HOME, timeout)
 
-    def start_find_me(self):
+    def start_find_me(self, timeout=None):
         """ Start the 'find me' mode. The RoboVac will repeatedly play a chime. """
-        command = _build_robovac_command(RobovacModes.FIND_ME, RobovacCommands.START_RING)
-        message = self._build_command_user_data_message(command)
-
-        self._send_packet(message, False)
+        self._send_command(RobovacModes.FIND_ME, RobovacCommands.START_RING, timeout)
 
-    def stop_find_me(self):
+    def stop_find_me(self, timeout=None):
         """ Stop the 'find me' mode. """
-        command = _build_robovac_command(RobovacModes.FIND_ME, RobovacCommands.STOP_RING)
-        message = self._build_command_user_data_message(command)
+        self._send_command(RobovacModes.FIND_ME, RobovacCommands.STOP_RING, timeout)
 
-        self._send_packet(message, False)
-
-    def use_normal_speed(self):
+    def use_normal_speed(self, timeout=None):
         """ Tell the RoboVac to use the standard fan speed. """
-        command = _build_robovac_command(RobovacModes.SET_SPEED, RobovacCommands.SLOW_SPEED)
-        message = self._build_command_user_data_message(command)
-
-        self._send_packet(message, False)
+        self._send_command(RobovacModes.SET_SPEED, RobovacCommands.SLOW_SPEED, timeout)
 
-    def use_max_speed(self):
+    def use_max_speed(self, timeout=None):
         """ Tell the RoboVac to use the maximum possible fan speed. """
-        command = _build_robovac_command(RobovacModes.SET_SPEED, RobovacCommands.FAST_SPEED)
-        message = self._build_command_user_data_message(command)
-
-        self._send_packet(message, False)
+        self._send_command(RobovacModes.SET_SPEED, RobovacCommands.FAST_SPEED, timeout)
 
-    def go_forward(self):
+    def go_forward(self, timeout=None):
         """ Tell the RoboVac to move forward without vacuuming. """
-        command = _build_robovac_command(RobovacModes.GO_FORWARD, RobovacCommands.MOVE)
-        message = self._build_command_user_data_message(command)
+        self._send_command(RobovacModes.GO_FORWARD, RobovacCommands.MOVE, timeout)
 
-        self._send_packet(message, False)
-
-    def go_backward(self):
+    def go_backward(self, timeout=None):
         """ Tell the RoboVac to move backward without vacuuming. """
-        command = _build_robovac_command(RobovacModes.GO_BACKWARD, RobovacCommands.MOVE)
-        message = self._build_command_user_data_message(command)
-
-        self._send_packet(message, False)
+        self._send_command(RobovacModes.GO_BACKWARD, RobovacCommands.MOVE, timeout)
 
-    def go_left(self):
+    def go_left(self, timeout=None):
         """ Tell the RoboVac to turn left without vacuuming. """
-        command = _build_robovac_command(RobovacModes.GO_LEFT, RobovacCommands.MOVE)
-        message = self._build_command_user_data_message(command)
-
-        self._send_packet(message, False)
+        self._send_command(RobovacModes.GO_LEFT, RobovacCommands.MOVE, timeout)
 
-    def go_right(self):
+    def go_right(self, timeout=None):
         """ Tell the RoboVac to turn right without vacuuming. """
-        command = _build_robovac_command(RobovacModes.GO_RIGHT, RobovacCommands.MOVE)
-        message = self._build_command_user_data_message(command)
+        self._send_command(RobovacModes.GO_RIGHT, RobovacCommands.MOVE, timeout)
 
-        self._send_packet(message, False)
+    def send_commands(self,
+                      steps: Iterable[Union[Tuple[RobovacModes, RobovacCommands],
+                                            Tuple[RobovacModes, RobovacCommands, float]]],
+                      confirm=False,
+                      timeout=None) -> 'CommandBatchResult':
+        """
+        Send a sequence of commands in one go, e.g. [(RobovacModes.SET_SPEED, RobovacCommands.FAST_SPEED, 0),
+        (RobovacModes.WORK, RobovacCommands.EDGE_CLEAN, 0)].
+
+        Consecutive steps without a delay between them are built from consecutive magic numbers, encrypted together
+        and written to the connection in one go. The client is free for other threads during delays, so each run of
+        steps takes its magic numbers when it is sent.
+        :param steps: (mode, command) or (mode, command, delay) tuples. The delay, in seconds, follows the step.
+        :param confirm: If true, the RoboVac's status is requested after the last command. The RoboVac handles
+            packets in order, so its reply acknowledges every command in the batch.
+        :param timeout: Seconds allowed for the batch on top of the delays between its steps.
+        """
+        steps = [(step[0], step[1], step[2] if len(step) > 2 else 0) for step in steps]
+        if not steps:
+            return CommandBatchResult([], None, None)
 
-    def _build_command_user_data_message(self, command_payload) -> LocalServerInfo_pb2.LocalServerMessage:
-        """ Build the Protobuf message in which a given command will be sent. """
-        magic_number = self._get_magic_number()
-        message = LocalServerInfo_pb2.LocalServerMessage()
-        message.magic_num = magic_number
-        message.localcode = self.local_code
-        message.c.type = 0
-        message.c.usr_data = command_payload
+        timeout = self.timeout if timeout is None else timeout
+        deadline = Deadline(None if timeout is None else timeout + sum(delay for _, _, delay in steps))
 
-        return message
+        if self.status_cache is not None:
+            self.status_cache.invalidate()
 
-    def _build_get_device_status_user_data_message(self) -> LocalServerInfo_pb2.LocalServerMessage:
-        """ Build the Protobuf message to get the RoboVac's status. """
-        magic_number = self._get_magic_number()
-        message = LocalServerInfo_pb2.LocalServerMessage()
-        message.localcode = self.local_code
-        message.magic_num = magic_number
-        message.c.type = 1
+        # Runs of steps without a delay between them. The delay of a run's last step follows the run.
+        runs = [[]]  # type: List[List[Tuple[RobovacModes, RobovacCommands, float]]]
+        for step in steps:
+            runs[-1].append(step)
+            if step[2] > 0:
+                runs.append([])
 
-        return message
+        results = []
+        reply = None
+        started_at = time.monotonic()
+
+        for index, run in enumerate(runs):
+            # The status request confirming the batch goes with the last run, after any delay of the last step
+            confirm_run = confirm and index == len(runs) - 1
+            if not run and not confirm_run:
+                continue
+
+            with self._locked(deadline):
+                magic_numbers, reply = self._send_run(run, confirm_run, deadline)
+
+            sent_after = time.monotonic() - started_at
+            results.extend(CommandStepResult(mode, command, magic_number, sent_after)
+                           for (mode, command, _), magic_number in zip(run, magic_numbers))
+
+            if run and run[-1][2] > 0:
+                # Other threads can use the client meanwhile
+                time.sleep(run[-1][2])
+
+        if not confirm:
+            return CommandBatchResult(results, None, None)
+
+        response = self._wait_for_reply(reply, deadline)
+        acknowledged_after = time.monotonic() - started_at
+        self.magic_numbers.observe(response.magic_num)
+
+        return CommandBatchResult(results, RobovacStatus.from_bytes(_status_usr_data(response)), acknowledged_after)
+
+    def _send_run(self,
+                  run: List[Tuple[RobovacModes, RobovacCommands, float]],
+                  confirm: bool,
+                  deadline: Deadline) -> Tuple[range, Optional[PendingReply]]:
+        """
+        Send a run of commands, and a status request if confirm is true, with consecutive magic numbers in one write.
+        Called with the lock held.
 
-    def _get_magic_number(self) -> int:
-        """ Send a ping packet and parse the response in order to retrieve the next magic number."""
-        ping = LocalServerInfo_pb2.LocalServerMessage()
-        ping.localcode = self.local_code
-        ping.magic_num = random.randrange(3000000)
+        :return: The magic numbers used, and the pending reply to the status request if one was sent.
+        """
+        first_magic_number = self._get_magic_number(deadline)
+        packet_count = len(run) + (1 if confirm else 0)
+        self.magic_numbers.advance(packet_count - 1)
+        magic_numbers = range(first_magic_number, first_magic_number + packet_count)
+
+        packets = [_command_template(self.local_code, mode, command).render(magic_number)
+                   for (mode, command, _), magic_number in zip(run, magic_numbers)]
+        if confirm:
+            packets.append(_status_request_template(self.local_code).render(magic_numbers[-1]))
+
+        reply = self._transmit(b''.join(crypto.encrypt_batch(packets)), confirm, deadline, magic_numbers[-1])
+        return magic_numbers, reply
+
+    def _send_command(self, mode: RobovacModes, command: RobovacCommands, timeout=None) -> None:
+        """ Send a command to the RoboVac, using a pre-serialized message in which only the magic number changes. """
+        if self.status_cache is not None:
+            self.status_cache.invalidate()
+
+        deadline = self._deadline(timeout)
+        with self._locked(deadline), self.metrics.timer('command'):
+            magic_number = self._get_magic_number(deadline)
+            template = _command_template(self.local_code, mode, command)
+            self._send_packet(template.render(magic_number), False, deadline)
+
+    def _deadline(self, timeout: Optional[float]) -> Deadline:
+        return Deadline(self.timeout if timeout is None else timeout)
+
+    @contextmanager
+    def _locked(self, deadline: Deadline):
+        """ Hold the lock, waiting for other threads' operations no longer than the deadline. """
+        timeout = deadline.remaining()
+        if not self._lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise RobovacTimeoutError(f'Timed out waiting for other operations on the RoboVac at {self.ip}')
+
+        try:
+            yield
+        finally:
+            self._lock.release()
+
+    def _get_magic_number(self, deadline: Deadline) -> int:
+        """
+        Retrieve the next magic number. If it cannot be predicted, a ping packet is sent and the response
+        parsed in order to retrieve it.
+        """
+        magic_number = self.magic_numbers.take()
+        if magic_number is not None:
+            return magic_number
+
+        try:
+            pong = self._handshake(deadline)
+        except RobovacAuthError:
+            if self._local_code_cache is None or not self._refresh_local_code():
+                raise
+
+            pong = self._handshake(deadline)
+
+        return self.magic_numbers.synchronise(pong.magic_num)
+
+    def _handshake(self, deadline: Deadline) -> 'LocalServerInfo_pb2.LocalServerMessage':
+        """
+        Ping the RoboVac. It closes the connection instead of replying to a packet with the wrong local code, so a
+        connection closed in reply to a ping twice in a row is taken to be an authentication failure.
+        """
+        for attempt in range(2):
+            try:
+                with self.metrics.timer('ping'):
+                    return self._send_packet(_build_ping_packet(self.local_code), True, deadline)
+            except (RobovacConnectionClosedError, ConnectionResetError) as e:
+                if attempt:
+                    raise RobovacAuthError(f'The RoboVac at {self.ip} refused the local code') from e
+
+    def _refresh_local_code(self) -> bool:
+        """
+        Replace a local code the RoboVac refused with the one now known to the Eufy cloud.
+
+        :return: True if there is a new local code to try.
+        """
+        logging.warning('RoboVac at %s refused the cached local code, refreshing it', self.ip)
+        cache = self._local_code_cache
+        cache.invalidate(self.ip, self._device_id)
+        if cache.cloud_client is None:
+            return False
+
+        entry = cache.refresh(self.ip if self._device_id is None else None, self._device_id)
+        if entry.local_code == self.local_code and entry.ip == self.ip:
+            return False
 
-        ping.a.type = 0
+        self.disconnect()
+        self.local_code = entry.local_code
+        if entry.ip != self.ip:
+            self.ip = entry.ip
+            self.connection.address = (entry.ip, self.port)
 
-        pong = self._send_packet(ping, True)
-        return pong.magic_num + 1
+        return True
 
     def _send_packet(self,
-                     packet: LocalServerInfo_pb2.LocalServerMessage,
-                     receive: True) -> Union[None, LocalServerInfo_pb2.LocalServerMessage]:
+                     raw_packet_data: bytes,
+                     receive: bool,
+                     deadline: Deadline) -> Union[None, 'LocalServerInfo_pb2.LocalServerMessage']:
         """
-        Send a packet to the RoboVac. This method handles all the required encryption.
+        Send a serialized packet to the RoboVac. This method handles all the required encryption.
 
-        Will attempt to reconnect to the RoboVac if sending a packet fails.
+        Connects to the RoboVac if necessary, and will attempt to reconnect if sending a packet fails.
         :param receive: If true, the packet sent in reply by the RoboVac will be parsed and returned.
         """
-        raw_packet_data = packet.SerializeToString()
-        encrypted_packet_data = _encrypt(raw_packet_data)
+        return self._send_encrypted_packet(_encrypt(raw_packet_data), receive, deadline)
 
-        try:
-            self.s.send(encrypted_packet_data)
-        except Exception as e:
-            logging.exception(e)
-            self.disconnect()
-            self.connect()
-            self.s.send(encrypted_packet_data )
+    def _send_encrypted_packet(self,
+                               encrypted_packet_data: bytes,
+                               receive: bool,
+                               deadline: Deadline,
+                               magic_number: int = None) -> Union[None, 'LocalServerInfo_pb2.LocalServerMessage']:
+        """
+        Send already encrypted data, which may hold several packets, and optionally receive one reply.
 
-        if not receive:
-            return None
+        :param magic_number: The magic number of a status request the reply answers, or None for a ping.
+        """
+        with self._locked(deadline):
+            reply = self._transmit(encrypted_packet_data, receive, deadline, magic_number)
+
+        return self._wait_for_reply(reply, deadline) if receive else None
+
+    def _transmit(self,
+                  encrypted_packet_data: bytes,
+                  receive: bool,
+                  deadline: Deadline,
+                  magic_number: int = None) -> Optional[PendingReply]:
+        """ Send already encrypted data, returning the reply expected if receive is true. Called with the lock held. """
+        for attempt in range(2):
+            sock, dispatcher = self._connect(deadline, reconnect=attempt > 0)
+
+            # Registered before sending, so the reply cannot arrive before anything is waiting for it
+            reply = dispatcher.expect(magic_number) if receive else None
+
+            try:
+                sock.sendall(encrypted_packet_data)
+                break
+            except OSError as e:
+                if reply is not None:
+                    dispatcher.discard(reply)
+                if attempt:
+                    if isinstance(e, socket.timeout):
+                        raise RobovacTimeoutError(f'Timed out sending to the RoboVac at {self.ip}') from e
+                    raise
+
+                logging.exception(e)
+                self.metrics.increment('send_errors')
+                self.metrics.increment('reconnects')
+
+        self.metrics.increment('bytes_sent', len(encrypted_packet_data))
+        return reply
+
+    def _connect(self, deadline: Deadline, reconnect=False) -> Tuple[socket.socket, 'ReplyDispatcher']:
+        """ The connected socket and the dispatcher reading its replies, connecting first if necessary. """
+        timeout = deadline.remaining(self.connect_timeout)
 
-        response_from_robovac = self.s.recv(1024)
-        decrypted_response = _decrypt(response_from_robovac)
-        return Robovac._parse_local_server_message_from_decrypted_response(decrypted_response)
+        try:
+            if reconnect:
+                self.connection.reconnect(timeout)
+
+            sock = self.connection.socket(timeout)
+            dispatcher = self._reply_dispatcher(sock)
+            if dispatcher.closed:
+                # The RoboVac closed the connection since it was last used
+                self.disconnect()
+                sock = self.connection.socket(timeout)
+                dispatcher = self._reply_dispatcher(sock)
+        except socket.timeout as e:
+            self.metrics.increment('timeouts')
+            raise RobovacTimeoutError(f'Timed out connecting to the RoboVac at {self.ip}') from e
+        except ConnectionBackoffError as e:
+            raise RobovacBackoffError(str(e)) from e
+
+        return sock, dispatcher
+
+    def _reply_dispatcher(self, sock: socket.socket) -> ReplyDispatcher:
+        """ The dispatcher reading replies from the socket, started on first use of a newly connected socket. """
+        if self._dispatcher is None or self._dispatcher.sock is not sock:
+            if self._dispatcher_finalizer is not None:
+                self._dispatcher_finalizer.detach()
+
+            self._dispatcher = ReplyDispatcher(sock, self.metrics, f'robovac-replies-{self.ip}')
+            # The reader thread keeps the socket open, so stop it if the client is dropped without disconnecting
+            self._dispatcher_finalizer = weakref.finalize(self, _shutdown_socket, sock)
+
+        return self._dispatcher
+
+    def _wait_for_reply(self, reply: PendingReply, deadline: Deadline) -> 'LocalServerInfo_pb2.LocalServerMessage':
+        try:
+            return reply.wait(deadline.remaining(self.read_timeout))
+        except RobovacTimeoutError:
+            # A late reply would be taken for the reply to a later request, so the connection is dropped
+            self.metrics.increment('timeouts')
+            self.connection.close(reply.dispatcher.sock)
+            raise
+        except (OSError, RobovacProtocolError):
+            # The connection is no longer usable, so reconnect on next use. Other threads waiting on the same
+            # connection fail too, and must not close any connection made since.
+            self.connection.close(reply.dispatcher.sock)
+            raise
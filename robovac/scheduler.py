@@ -0,0 +1,294 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from enum import IntEnum
+from typing import Callable, Deque, Dict, Optional, Tuple, Union
+
+from robovac.robovac import Robovac, RobovacCommands, RobovacError, RobovacModes, RobovacStatus, RobovacTimeoutError
+
+Command = Tuple[RobovacModes, RobovacCommands]
+
+
+class Priority(IntEnum):
+    """ Order in which queued commands are sent. Lower values are sent first. """
+
+    URGENT = 0
+    NORMAL = 1
+    MOVEMENT = 2
+
+
+# Every command sent by a Robovac method, by method name
+COMMANDS = {
+    'start_auto_clean': (RobovacModes.WORK, RobovacCommands.AUTO_CLEAN),
+    'start_spot_clean': (RobovacModes.WORK, RobovacCommands.SPOT_CLEAN),
+    'start_edge_clean': (RobovacModes.WORK, RobovacCommands.EDGE_CLEAN),
+    'start_single_room_clean': (RobovacModes.WORK, RobovacCommands.SINGLE_ROOM_CLEAN),
+    'stop': (RobovacModes.WORK, RobovacCommands.STOP_CLEAN),
+    'go_home': (RobovacModes.WORK, RobovacCommands.GO_HOME),
+    'start_find_me': (RobovacModes.FIND_ME, RobovacCommands.START_RING),
+    'stop_find_me': (RobovacModes.FIND_ME, RobovacCommands.STOP_RING),
+    'use_normal_speed': (RobovacModes.SET_SPEED, RobovacCommands.SLOW_SPEED),
+    'use_max_speed': (RobovacModes.SET_SPEED, RobovacCommands.FAST_SPEED),
+    'go_forward': (RobovacModes.GO_FORWARD, RobovacCommands.MOVE),
+    'go_backward': (RobovacModes.GO_BACKWARD, RobovacCommands.MOVE),
+    'go_left': (RobovacModes.GO_LEFT, RobovacCommands.MOVE),
+    'go_right': (RobovacModes.GO_RIGHT, RobovacCommands.MOVE),
+}
+
+_URGENT_COMMANDS = {COMMANDS['stop'], COMMANDS['go_home']}
+_MOVEMENT_MODES = {RobovacModes.GO_FORWARD, RobovacModes.GO_BACKWARD, RobovacModes.GO_LEFT, RobovacModes.GO_RIGHT}
+
+# Modes which set a value on the RoboVac, so only the last of several queued commands matters
+_SETTING_MODES = {RobovacModes.SET_SPEED, RobovacModes.FIND_ME}
+
+
+def default_priority(command: Command) -> Priority:
+    """ stop and go_home are urgent, the manual movement commands are sent last and everything else in between. """
+    if command in _URGENT_COMMANDS:
+        return Priority.URGENT
+    if command[0] in _MOVEMENT_MODES:
+        return Priority.MOVEMENT
+
+    return Priority.NORMAL
+
+
+class SchedulerClosedError(RobovacError):
+    """ Exception raised when submitting to a CommandScheduler which has been closed """
+
+
+class TokenBucket:
+    """ Allows bursts of up to capacity operations, refilling at rate operations per second. """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def delay(self) -> float:
+        """ Seconds until a token will be available, or 0 if one is available now. """
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self) -> bool:
+        """ Take a token, returning false without waiting if there is none. """
+        self._refill()
+        if self._tokens < 1:
+            return False
+
+        self._tokens -= 1
+        return True
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+
+class _QueuedOperation:
+    """ A command or status request waiting to be sent, and the future its sender waits on. """
+
+    __slots__ = ('command', 'call', 'future')
+
+    def __init__(self, command: Optional[Command], call: Callable[[], object]):
+        self.command = command
+        self.call = call
+        self.future = Future()
+
+
+class CommandScheduler:
+    """
+    Serialises every command to a single RoboVac, so several threads or services can share it.
+
+    Operations are queued and sent one at a time by a background thread, which is the only user of the Robovac's
+    connection, so each reply is always read by the request it belongs to. Sends are rate limited by a token
+    bucket, so bursts of commands cannot overrun the RoboVac.
+
+    Queued operations are sent in priority order, then in the order submitted. stop and go_home are urgent: they
+    are sent before anything else waiting, and discard any movement commands still queued, which would otherwise
+    move the RoboVac after it was told to stop. A work command repeating the last one queued at its priority, or a
+    command changing the same setting such as the fan speed, replaces it, and both callers wait on the single send.
+    Repeated movement commands are all sent, as each one moves the RoboVac, and are only paced by the token bucket.
+    """
+
+    def __init__(self,
+                 robovac: Robovac,
+                 rate=4.0,
+                 burst=2,
+                 priority: Callable[[Command], Priority] = default_priority):
+        """
+        :param robovac: The RoboVac to schedule commands for. It should only be used through the scheduler.
+        :param rate: Maximum sustained packets sent per second.
+        :param burst: Number of packets which may be sent back to back after a quiet period.
+        :param priority: Returns the priority of a command submitted without one.
+        """
+        self.robovac = robovac
+        self.bucket = TokenBucket(rate, burst)
+        self.priority = priority
+        self.sent = 0
+        self.collapsed = 0
+        self.preempted = 0
+        self._queues = {level: deque() for level in Priority}  # type: Dict[Priority, Deque[_QueuedOperation]]
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f'robovac-scheduler-{robovac.ip}', daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> 'CommandScheduler':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        """ The number of operations waiting to be sent. """
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, command: Union[str, Command], priority: Priority = None) -> 'Future[None]':
+        """
+        Queue a command to be sent to the RoboVac.
+
+        :param command: The name of a Robovac method, e.g. 'go_forward', or a (mode, command) pair.
+        :param priority: Overrides the priority of the command.
+        :return: A future resolved once the command has been sent, or failed to be.
+        """
+        if isinstance(command, str):
+            command = COMMANDS[command]
+        if priority is None:
+            priority = self.priority(command)
+
+        with self._condition:
+            self._check_open()
+            queue = self._queues[priority]
+            if priority == Priority.URGENT:
+                self._discard_movement()
+
+            if queue and queue[-1].command is not None and self._redundant(queue[-1].command, command):
+                # The RoboVac only needs the newer of two commands setting the same thing
+                queue[-1].command = command
+                queue[-1].call = self._command_call(command)
+                self.collapsed += 1
+                self.robovac.metrics.increment('commands_collapsed')
+                return queue[-1].future
+
+            operation = _QueuedOperation(command, self._command_call(command))
+            queue.append(operation)
+            self._condition.notify()
+
+        return operation.future
+
+    def get_status(self, priority=Priority.NORMAL) -> 'Future[RobovacStatus]':
+        """ Queue a status request. Status requests are rate limited with commands, but never collapsed. """
+        with self._condition:
+            self._check_open()
+            operation = _QueuedOperation(None, self.robovac.get_status)
+            self._queues[priority].append(operation)
+            self._condition.notify()
+
+        return operation.future
+
+    def send(self, command: Union[str, Command], priority: Priority = None, timeout: float = None) -> None:
+        """
+        Submit a command and wait until it has been sent, raising any error sending it.
+
+        :raises RobovacTimeoutError: If the command was not sent within the timeout. It stays queued.
+        """
+        future = self.submit(command, priority)
+
+        try:
+            future.result(timeout)
+        except FutureTimeoutError:
+            if future.done():
+                raise
+            raise RobovacTimeoutError(f'The command was not sent to the RoboVac at {self.robovac.ip} in time') from None
+
+    def close(self, cancel_pending=False, timeout: float = None) -> None:
+        """
+        Stop accepting operations and stop the background thread once the queue has been sent.
+
+        :param cancel_pending: If true, operations still queued are cancelled rather than sent.
+        """
+        with self._condition:
+            self._closed = True
+            if cancel_pending:
+                for queue in self._queues.values():
+                    while queue:
+                        queue.popleft().future.cancel()
+            self._condition.notify()
+
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        """ Counters of operations sent, collapsed into others and discarded by urgent commands. """
+        return {'sent': self.sent, 'collapsed': self.collapsed, 'preempted': self.preempted}
+
+    def _command_call(self, command: Command) -> Callable[[], None]:
+        return lambda: self.robovac._send_command(*command)
+
+    @staticmethod
+    def _redundant(queued: Command, command: Command) -> bool:
+        """ Movement commands each move the RoboVac, so are never redundant. Only idempotent commands are. """
+        if queued[0] != command[0]:
+            return False
+
+        return command[0] in _SETTING_MODES or (command[0] == RobovacModes.WORK and queued == command)
+
+    def _check_open(self) -> None:
+        if self._closed:
+            raise SchedulerClosedError(f'The command scheduler for {self.robovac.ip} is closed')
+
+    def _discard_movement(self) -> None:
+        """ Cancel every queued movement command. Called with the condition held. """
+        for queue in self._queues.values():
+            kept = [operation for operation in queue
+                    if operation.command is None or operation.command[0] not in _MOVEMENT_MODES]
+            for operation in queue:
+                if operation.command is not None and operation.command[0] in _MOVEMENT_MODES:
+                    operation.future.cancel()
+                    self.preempted += 1
+                    self.robovac.metrics.increment('commands_preempted')
+
+            queue.clear()
+            queue.extend(kept)
+
+    def _next_operation(self) -> Optional[_QueuedOperation]:
+        """ Wait for the highest priority operation and a token to send it. Returns None once closed and empty. """
+        with self._condition:
+            while True:
+                operations = [queue for queue in self._queues.values() if queue]
+                if not operations:
+                    if self._closed:
+                        return None
+                    self._condition.wait()
+                    continue
+
+                delay = self.bucket.delay()
+                if delay > 0:
+                    # Woken early by a new submission, so an urgent command can overtake the one waiting
+                    self._condition.wait(delay)
+                    continue
+
+                self.bucket.take()
+                return operations[0].popleft()
+
+    def _run(self) -> None:
+        while True:
+            operation = self._next_operation()
+            if operation is None:
+                return
+
+            if not operation.future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = operation.call()
+            except Exception as e:
+                logging.warning('Scheduled operation for RoboVac at %s failed: %s', self.robovac.ip, e)
+                operation.future.set_exception(e)
+            else:
+                operation.future.set_result(result)
+            finally:
+                self.sent += 1
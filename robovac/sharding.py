@@ -0,0 +1,477 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import struct
+import time
+from multiprocessing.connection import wait
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from robovac.aio import AsyncRobovac
+from robovac.fleet import _call
+from robovac.robovac import (
+    RobovacAuthError,
+    RobovacBackoffError,
+    RobovacConnectionClosedError,
+    RobovacError,
+    RobovacProtocolError,
+    RobovacStatus,
+    RobovacTimeoutError,
+    _CHARGER_STATUSES,
+    _ERROR_CODES,
+    _STATUS_MODES,
+)
+
+# Results are streamed from workers in frames of packed records rather than pickled objects:
+#   frame header: request id, flags, number of records
+#   record: device index, result kind, then the result (8 status bytes, or a length and error message/pickled value)
+_FRAME = struct.Struct('<IBH')
+_RECORD = struct.Struct('<IB')
+_STATUS = struct.Struct('8B')
+_LENGTH = struct.Struct('<I')
+_LAST_FRAME = 0x01
+
+# Seconds a worker holds results before sending them, even if fewer than flush_size bytes are buffered
+_FLUSH_INTERVAL = 0.05
+
+_ACK = 0
+_STATUS_RESULT = 1
+_ERROR = 2
+_VALUE = 3
+
+
+class RemoteRobovacError(RobovacError):
+    """ Exception raised in a fleet worker process, returned in place of a result """
+
+
+# Errors raised again as themselves in the parent process, rather than as a RemoteRobovacError
+_TYPED_ERRORS = {error.__name__: error for error in (
+    RobovacAuthError,
+    RobovacBackoffError,
+    RobovacConnectionClosedError,
+    RobovacProtocolError,
+    RobovacTimeoutError,
+)}
+
+
+def _decode_error(data: bytes) -> Exception:
+    text = data.decode()
+    name, _, message = text.partition(': ')
+    return _TYPED_ERRORS[name](message) if name in _TYPED_ERRORS else RemoteRobovacError(text)
+
+
+class ConsistentHashRing:
+    """
+    Maps keys to nodes so that adding or removing a node only moves the keys of that node.
+
+    Each node is placed on the ring at many points (replicas), which spreads keys evenly between nodes.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas=100):
+        self.replicas = replicas
+        self._points = []  # type: List[int]
+        self._nodes = {}  # type: Dict[int, str]
+
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(set(self._nodes.values()))
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+    def add(self, node: str) -> None:
+        for replica in range(self.replicas):
+            point = self._hash(f'{node}#{replica}')
+            if point not in self._nodes:
+                bisect.insort(self._points, point)
+                self._nodes[point] = node
+
+    def remove(self, node: str) -> None:
+        for replica in range(self.replicas):
+            point = self._hash(f'{node}#{replica}')
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                del self._points[bisect.bisect_left(self._points, point)]
+
+    def node_for(self, key: str) -> str:
+        """ The node owning the key: the first node on the ring at or after the key's hash. """
+        if not self._points:
+            raise LookupError('The ring has no nodes')
+
+        index = bisect.bisect_left(self._points, self._hash(key)) % len(self._points)
+        return self._nodes[self._points[index]]
+
+
+def _encode_result(index: int, result: object) -> bytes:
+    if result is None:
+        return _RECORD.pack(index, _ACK)
+
+    if isinstance(result, RobovacStatus):
+        return _RECORD.pack(index, _STATUS_RESULT) + _STATUS.pack(*result)
+
+    if isinstance(result, Exception):
+        kind = _ERROR
+        data = f'{type(result).__name__}: {result}'.encode()
+    else:
+        kind = _VALUE
+        data = pickle.dumps(result)
+
+    return _RECORD.pack(index, kind) + _LENGTH.pack(len(data)) + data
+
+
+def _decode_frame(frame: bytes) -> Tuple[int, bool, List[Tuple[int, object]]]:
+    """ Decode a frame of results into its request id, whether it is the last frame, and (device index, result). """
+    request_id, flags, count = _FRAME.unpack_from(frame)
+    offset = _FRAME.size
+    results = []
+
+    for _ in range(count):
+        index, kind = _RECORD.unpack_from(frame, offset)
+        offset += _RECORD.size
+
+        if kind == _ACK:
+            result = None
+        elif kind == _STATUS_RESULT:
+            find_me, water_tank, mode, speed, charger, battery, error, stop = _STATUS.unpack_from(frame, offset)
+            offset += _STATUS.size
+            result = RobovacStatus(find_me, water_tank, _STATUS_MODES.get(mode, mode), speed,
+                                   _CHARGER_STATUSES.get(charger, charger), battery, _ERROR_CODES.get(error, error),
+                                   stop)
+        else:
+            (length,) = _LENGTH.unpack_from(frame, offset)
+            offset += _LENGTH.size
+            data = frame[offset:offset + length]
+            offset += length
+            result = _decode_error(data) if kind == _ERROR else pickle.loads(data)
+
+        results.append((index, result))
+
+    return request_id, bool(flags & _LAST_FRAME), results
+
+
+async def _worker_call(conn, robovacs: Dict[int, AsyncRobovac], request_id: int, method: str, args, kwargs,
+                       indexes: Optional[List[int]], deadline: Optional[float], max_concurrency: int,
+                       flush_size: int) -> None:
+    """
+    Call a method on the worker's RoboVacs, streaming results back in frames of up to flush_size bytes, sent at
+    least every _FLUSH_INTERVAL. RoboVacs not finished by the deadline fail, so the worker is free for the next call.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    records = []
+    buffered = 0
+
+    def flush(last: bool) -> None:
+        nonlocal records, buffered
+        conn.send_bytes(_FRAME.pack(request_id, _LAST_FRAME if last else 0, len(records)) + b''.join(records))
+        records = []
+        buffered = 0
+
+    async def flush_periodically() -> None:
+        while True:
+            await asyncio.sleep(_FLUSH_INTERVAL)
+            if records:
+                flush(False)
+
+    async def call_one(index: int, robovac: AsyncRobovac) -> None:
+        nonlocal buffered
+        result = await _call(robovac, method, args, kwargs, semaphore, deadline)
+
+        record = _encode_result(index, result)
+        records.append(record)
+        buffered += len(record)
+        if buffered >= flush_size or len(records) == 0xFFFF:
+            flush(False)
+
+    selected = robovacs if indexes is None else {index: robovacs[index] for index in indexes if index in robovacs}
+    flusher = asyncio.ensure_future(flush_periodically())
+    try:
+        await asyncio.gather(*(call_one(index, robovac) for index, robovac in selected.items()))
+    finally:
+        flusher.cancel()
+
+    flush(True)
+
+
+def _worker_main(conn, port: int, timeout: float, predict_magic_numbers: bool, max_concurrency: int,
+                 flush_size: int) -> None:
+    """ Entry point of a worker process. Requests from the parent are handled one at a time, in order. """
+    loop = asyncio.new_event_loop()
+    robovacs = {}  # type: Dict[int, AsyncRobovac]
+
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                break
+
+            if request[0] == 'assign':
+                devices = request[1]
+                for index in set(robovacs) - set(devices):
+                    loop.run_until_complete(robovacs.pop(index).disconnect())
+                for index, (ip, local_code) in devices.items():
+                    if index not in robovacs:
+                        robovacs[index] = AsyncRobovac(ip, local_code, port, timeout, predict_magic_numbers)
+            elif request[0] == 'call':
+                loop.run_until_complete(_worker_call(conn, robovacs, *request[1:], max_concurrency, flush_size))
+            elif request[0] == 'stop':
+                break
+    finally:
+        for robovac in robovacs.values():
+            loop.run_until_complete(robovac.disconnect())
+        loop.close()
+
+
+class _Worker:
+    __slots__ = ('name', 'process', 'conn', 'indexes')
+
+    def __init__(self, name: str, process, conn):
+        self.name = name
+        self.process = process
+        self.conn = conn
+        self.indexes = set()  # type: Set[int]
+
+
+class ShardedRobovacFleet:
+    """
+    Many RoboVacs driven from a pool of worker processes, so encryption and parsing are spread across CPU cores.
+
+    RoboVacs are assigned to workers by consistent hashing of their IP addresses. Each worker owns the connections to
+    its RoboVacs and drives them concurrently from its own event loop. Results are streamed back to the parent in
+    compact binary frames as they arrive. If a worker dies, its RoboVacs are rebalanced across the remaining workers
+    (or a replacement worker, if respawn is true), and any results it still owed are requested again from their new
+    workers.
+    """
+
+    def __init__(self,
+                 devices: Iterable[Tuple[str, str]],
+                 workers: Optional[int] = None,
+                 port=55556,
+                 timeout=10.0,
+                 predict_magic_numbers=False,
+                 max_concurrency=64,
+                 respawn=False,
+                 start_method='spawn',
+                 flush_size=4096):
+        """
+        :param devices: (ip, local_code) pairs for every RoboVac in the fleet.
+        :param workers: Number of worker processes. Defaults to the number of CPUs.
+        :param max_concurrency: Maximum number of RoboVacs each worker communicates with at the same time.
+        :param respawn: If true, a dead worker is replaced by a new one owning the same RoboVacs.
+        :param flush_size: Bytes of results a worker buffers before sending them to the parent.
+        """
+        self.devices = list(devices)
+        self.worker_count = workers or os.cpu_count() or 1
+        self.port = port
+        self.timeout = timeout
+        self.predict_magic_numbers = predict_magic_numbers
+        self.max_concurrency = max_concurrency
+        self.respawn = respawn
+        self.flush_size = flush_size
+        self.worker_deaths = 0
+        self._context = multiprocessing.get_context(start_method)
+        self._ring = ConsistentHashRing()
+        self._workers = {}  # type: Dict[str, _Worker]
+        self._request_ids = itertools.count(1)
+
+    def __len__(self) -> int:
+        return len(self.devices)
+
+    def __enter__(self) -> 'ShardedRobovacFleet':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self) -> None:
+        """ Start the worker processes and assign every RoboVac to one of them. """
+        for number in range(self.worker_count):
+            name = f'worker-{number}'
+            self._start_worker(name)
+            self._ring.add(name)
+
+        self._rebalance()
+
+    def stop(self) -> None:
+        """ Stop every worker process, closing its connections. """
+        for worker in self._workers.values():
+            try:
+                worker.conn.send(('stop',))
+            except OSError:
+                pass
+
+        for worker in self._workers.values():
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+
+        self._workers = {}
+        self._ring = ConsistentHashRing()
+
+    def assignments(self) -> Dict[str, List[str]]:
+        """ The IP addresses of the RoboVacs owned by each worker. """
+        return {name: [self.devices[index][0] for index in sorted(worker.indexes)]
+                for name, worker in self._workers.items()}
+
+    def get_status(self, timeout=None, deadline=None) -> Dict[str, Union[RobovacStatus, Exception]]:
+        """ Poll the status of every RoboVac in the fleet, returning a mapping of IP to status or error. """
+        return self.call('get_status', timeout=timeout, deadline=deadline)
+
+    def call(self, method: str, *args, deadline: float = None, **kwargs) -> Dict[str, Union[object, Exception]]:
+        """
+        Call an AsyncRobovac method, e.g. 'go_home', on every RoboVac in the fleet.
+
+        :return: Mapping of IP to the method's result, or the exception it raised.
+        """
+        return dict(self.stream(method, *args, deadline=deadline, **kwargs))
+
+    def stream(self,
+               method: str,
+               *args,
+               deadline: float = None,
+               **kwargs) -> Iterator[Tuple[str, Union[object, Exception]]]:
+        """
+        Call an AsyncRobovac method on every RoboVac, yielding (ip, result or exception) as results arrive.
+
+        :param deadline: Seconds allowed for the whole sweep. Workers stop waiting for RoboVacs at the deadline, and
+            RoboVacs whose results have not arrived by then are yielded with a RobovacTimeoutError.
+        """
+        self._check_workers()
+        expires_at = None if deadline is None else time.monotonic() + deadline
+
+        request_id = next(self._request_ids) & 0xFFFFFFFF
+        # Worker name -> [calls still running, device indexes still owed]
+        pending = {}  # type: Dict[str, list]
+        retried = set()  # type: Set[int]
+
+        def send_call(name: str, indexes: Optional[List[int]]) -> None:
+            worker = self._workers[name]
+            owed = set(worker.indexes if indexes is None else indexes)
+            if not owed:
+                return
+
+            remaining = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+            try:
+                worker.conn.send(('call', request_id, method, args, kwargs, indexes, remaining))
+            except OSError:
+                # The worker has died, which is handled once its process sentinel is ready
+                pass
+
+            calls = pending.setdefault(name, [0, set()])
+            calls[0] += 1
+            calls[1] |= owed
+
+        for name in list(self._workers):
+            send_call(name, None)
+
+        while pending:
+            waiting = {}
+            for name in pending:
+                worker = self._workers[name]
+                waiting[worker.conn] = name
+                waiting[worker.process.sentinel] = name
+
+            timeout = None if expires_at is None else max(0.0, expires_at - time.monotonic())
+            readable = wait(list(waiting), timeout)
+            if not readable and timeout is not None and time.monotonic() >= expires_at:
+                for name, (_, owed) in pending.items():
+                    for index in owed:
+                        yield self.devices[index][0], RobovacTimeoutError(
+                            f'No result from {name} within the fleet deadline of {deadline}s')
+                return
+
+            dead = set()
+            for ready in readable:
+                name = waiting[ready]
+                worker = self._workers[name]
+
+                try:
+                    while name in pending and worker.conn.poll():
+                        returned_id, last, results = _decode_frame(worker.conn.recv_bytes())
+                        if returned_id != request_id:
+                            continue
+
+                        for index, result in results:
+                            pending[name][1].discard(index)
+                            yield self.devices[index][0], result
+
+                        if last:
+                            pending[name][0] -= 1
+                            if pending[name][0] == 0:
+                                del pending[name]
+                except (EOFError, OSError):
+                    dead.add(name)
+
+                if name in pending and not worker.process.is_alive():
+                    dead.add(name)
+
+            for name in dead:
+                owed = pending.pop(name, [0, set()])[1]
+                self._handle_worker_death(name)
+
+                for index in owed & retried:
+                    yield self.devices[index][0], RobovacError('The workers owning this RoboVac died')
+
+                retry = owed - retried
+                retried |= retry
+                by_worker = {}  # type: Dict[str, List[int]]
+                for index in retry:
+                    by_worker.setdefault(self._ring.node_for(self.devices[index][0]), []).append(index)
+                for owner, indexes in by_worker.items():
+                    send_call(owner, sorted(indexes))
+
+    def _start_worker(self, name: str) -> None:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.port, self.timeout, self.predict_magic_numbers, self.max_concurrency,
+                  self.flush_size),
+            name=f'robovac-{name}',
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self._workers[name] = _Worker(name, process, parent_conn)
+
+    def _check_workers(self) -> None:
+        """ Rebalance away from any worker that died while the fleet was idle. """
+        for name, worker in list(self._workers.items()):
+            if not worker.process.is_alive():
+                self._handle_worker_death(name)
+
+    def _handle_worker_death(self, name: str) -> None:
+        worker = self._workers.pop(name)
+        worker.conn.close()
+        worker.process.join(timeout=1)
+        self.worker_deaths += 1
+        logging.warning('Fleet %s died with exit code %s', name, worker.process.exitcode)
+
+        if self.respawn:
+            self._start_worker(name)
+        else:
+            self._ring.remove(name)
+            if not self._workers:
+                raise RobovacError('Every fleet worker has died')
+
+        self._rebalance()
+
+    def _rebalance(self) -> None:
+        """ Assign every RoboVac to the worker owning it on the ring, telling workers whose RoboVacs changed. """
+        assignments = {name: set() for name in self._workers}
+        for index, (ip, _) in enumerate(self.devices):
+            assignments[self._ring.node_for(ip)].add(index)
+
+        for name, indexes in assignments.items():
+            worker = self._workers[name]
+            if indexes != worker.indexes:
+                worker.conn.send(('assign', {index: self.devices[index] for index in indexes}))
+                worker.indexes = indexes
@@ -0,0 +1,392 @@
+import argparse
+import asyncio
+import ipaddress
+import logging
+import random
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from google.protobuf.message import DecodeError
+
+from robovac import LocalServerInfo_pb2, crypto
+from robovac.cloud_simulator import EufyCloudSimulator
+from robovac.robovac import (
+    RobovacChargerStatuses,
+    RobovacCommands,
+    RobovacErrorCodes,
+    RobovacModes,
+    RobovacStatusModes,
+)
+
+_UserDataMessage = LocalServerInfo_pb2.LocalServerMessage.UserDataMessage
+_PING_RESPONSE = LocalServerInfo_pb2.LocalServerMessage.PingPacketMessage.PING_RESPONSE
+
+_WORK_MODES = {
+    RobovacCommands.AUTO_CLEAN.value: RobovacStatusModes.AUTO_CLEAN,
+    RobovacCommands.SINGLE_ROOM_CLEAN.value: RobovacStatusModes.SINGLE_ROOM_CLEAN,
+    RobovacCommands.SPOT_CLEAN.value: RobovacStatusModes.SPOT_CLEAN,
+    RobovacCommands.EDGE_CLEAN.value: RobovacStatusModes.EDGE_CLEAN,
+    RobovacCommands.STOP_CLEAN.value: RobovacStatusModes.STOPPED,
+    RobovacCommands.GO_HOME.value: RobovacStatusModes.GOING_HOME,
+}
+
+_CLEANING_MODES = (RobovacStatusModes.AUTO_CLEAN, RobovacStatusModes.SINGLE_ROOM_CLEAN,
+                   RobovacStatusModes.SPOT_CLEAN, RobovacStatusModes.EDGE_CLEAN)
+
+
+def _encrypt_frame(message: LocalServerInfo_pb2.LocalServerMessage) -> bytes:
+    """ Encrypt a message the way the RoboVac sends it: length prefixed and padded to a whole number of blocks. """
+    raw = message.SerializeToString()
+    frame = struct.pack('<H', len(raw)) + raw
+    blocks = (len(frame) + crypto.BLOCK_SIZE - 1) // crypto.BLOCK_SIZE
+
+    # crypto.encrypt always adds padding. In CBC mode, dropping a trailing block leaves the others intact.
+    return crypto.encrypt(frame)[:blocks * crypto.BLOCK_SIZE]
+
+
+def _parse_client_packet(decrypted: bytes) -> Optional[LocalServerInfo_pb2.LocalServerMessage]:
+    """
+    Parse a decrypted packet sent by a client, or return None if it is incomplete.
+
+    Clients zero-pad packets without a length prefix, and a packet may itself end in zero bytes, so the zeros
+    are stripped and then restored one at a time until the packet parses.
+    """
+    if not decrypted or decrypted[-1] != 0:
+        return None
+
+    stripped = decrypted.rstrip(b'\0')
+    for restored in range(len(decrypted) - len(stripped)):
+        message = LocalServerInfo_pb2.LocalServerMessage()
+        try:
+            message.ParseFromString(stripped + bytes(restored))
+        except DecodeError:
+            continue
+
+        if message.IsInitialized() and message.WhichOneof('playload') is not None:
+            return message
+
+    return None
+
+
+class SimulatedRobovac:
+    """
+    State machine standing in for a single RoboVac.
+
+    Battery drains while cleaning and charges while docked. A RoboVac running low on battery returns home on its own.
+    time_scale speeds up the simulation, e.g. 60 makes every real second a simulated minute.
+    """
+
+    def __init__(self, local_code: str, battery_capacity=100, time_scale=1.0):
+        self.local_code = local_code
+        self.mode = RobovacStatusModes.STOPPED
+        self.speed = 0
+        self.find_me = 0
+        self.water_tank_status = 0
+        self.charger_status = RobovacChargerStatuses.CHARGING
+        self.battery_capacity = float(battery_capacity)
+        self.error_code = RobovacErrorCodes.NO_ERROR
+        self.time_scale = time_scale
+        self.magic_number = random.randrange(3000000)
+        self.commands_received = 0
+        self.status_requests_received = 0
+        self.pings_received = 0
+        self._last_update = time.monotonic()
+        self._home_at = None
+
+    def advance(self) -> None:
+        """ Move the simulation on to the current time. """
+        now = time.monotonic()
+        elapsed = (now - self._last_update) * self.time_scale
+        self._last_update = now
+
+        if self.mode in _CLEANING_MODES:
+            # A full battery lasts about 100 minutes of cleaning
+            self.battery_capacity = max(0.0, self.battery_capacity - elapsed / 60)
+            if self.battery_capacity <= 10:
+                self._go_home()
+        elif self.mode == RobovacStatusModes.GOING_HOME:
+            if self._home_at is not None and now >= self._home_at:
+                self.mode = RobovacStatusModes.STOPPED
+                self.charger_status = RobovacChargerStatuses.CHARGING
+                self._home_at = None
+
+        if self.charger_status == RobovacChargerStatuses.CHARGING:
+            self.battery_capacity = min(100.0, self.battery_capacity + elapsed / 180)
+
+    def handle_command(self, payload: bytes) -> None:
+        """ Apply a command sent in the user data of a message. """
+        self.advance()
+        if len(payload) < 5 or payload[0] != 0xA5 or payload[4] != 0xFA:
+            logging.warning('Simulated RoboVac ignoring malformed command %s', payload.hex())
+            return
+
+        self.commands_received += 1
+        mode, command = payload[1], payload[2]
+
+        if mode == RobovacModes.WORK.value:
+            if command == RobovacCommands.GO_HOME.value:
+                self._go_home()
+            elif command in _WORK_MODES:
+                self.mode = _WORK_MODES[command]
+                self.charger_status = RobovacChargerStatuses.NOT_CHARGING
+        elif mode == RobovacModes.SET_SPEED.value:
+            self.speed = command
+        elif mode == RobovacModes.FIND_ME.value:
+            self.find_me = command
+
+    def status_bytes(self) -> bytes:
+        """ The user data of a status response, in the layout decoded by RobovacStatus.from_bytes. """
+        self.advance()
+        flags = (self.find_me << 2) | (self.water_tank_status << 1)
+
+        return bytes([0xA5, self.mode, 0, 0, 0, 0, flags, 0, self.speed, 0, int(self.battery_capacity),
+                      self.charger_status, self.error_code, 1 if self.mode == RobovacStatusModes.STOPPED else 0, 0xFA])
+
+    def _go_home(self) -> None:
+        self.mode = RobovacStatusModes.GOING_HOME
+        self.charger_status = RobovacChargerStatuses.NOT_CHARGING
+        self._home_at = time.monotonic() + 30 / self.time_scale
+
+
+class RobovacSimulator:
+    """
+    Serve many simulated RoboVacs over the same encrypted Protobuf protocol as a real RoboVac, from a single process.
+
+    Each simulated RoboVac listens on its own port. Faults can be injected to test clients:
+    :param latency: Seconds to wait before every reply, or a (minimum, maximum) range to pick from at random.
+    :param split_size: If set, replies are written in chunks of at most this many bytes.
+    :param drop_probability: Probability of closing the connection instead of handling a packet.
+    :param push_interval: If set, every RoboVac pushes its status to connected clients at this interval.
+    :param strict_magic_numbers: If true, packets with an unexpected magic number are ignored, like a real RoboVac.
+    """
+
+    def __init__(self,
+                 latency: Union[float, Tuple[float, float]] = 0.0,
+                 split_size: Optional[int] = None,
+                 drop_probability=0.0,
+                 push_interval: Optional[float] = None,
+                 strict_magic_numbers=False,
+                 time_scale=1.0):
+        self.latency = latency
+        self.split_size = split_size
+        self.drop_probability = drop_probability
+        self.push_interval = push_interval
+        self.strict_magic_numbers = strict_magic_numbers
+        self.time_scale = time_scale
+        self.devices = {}  # type: Dict[Tuple[str, int], SimulatedRobovac]
+        self._servers = []
+        self._connections = set()
+
+    async def start(self, count=1, host='127.0.0.1', base_port=55556) -> List[Tuple[str, int, str]]:
+        """
+        Start serving simulated RoboVacs on consecutive ports. Use port 0 to let the OS pick free ports.
+
+        :return: (host, port, local_code) for every simulated RoboVac started.
+        """
+        return [await self._start_device(host, base_port + index if base_port else 0) for index in range(count)]
+
+    async def start_on_hosts(self, hosts: Iterable[str], port=55556) -> List[Tuple[str, int, str]]:
+        """
+        Start serving a simulated RoboVac on the same port of every given address, like a real network of RoboVacs.
+        Every address in 127.0.0.0/8 is a loopback address on Linux, e.g. 127.0.1.1 to 127.0.1.254.
+
+        :return: (host, port, local_code) for every simulated RoboVac started.
+        """
+        return [await self._start_device(host, port) for host in hosts]
+
+    async def _start_device(self, host: str, port: int) -> Tuple[str, int, str]:
+        device = SimulatedRobovac(f'SIMULATED{len(self.devices):07d}', time_scale=self.time_scale)
+
+        server = await asyncio.start_server(
+            lambda reader, writer: self._serve(device, reader, writer),
+            host,
+            port
+        )
+        port = server.sockets[0].getsockname()[1]
+
+        self._servers.append(server)
+        self.devices[host, port] = device
+        return host, port, device.local_code
+
+    async def stop(self) -> None:
+        """ Stop serving every simulated RoboVac, closing any open connections. """
+        for server in self._servers:
+            server.close()
+
+        for connection in list(self._connections):
+            connection.cancel()
+
+        for server in self._servers:
+            await server.wait_closed()
+
+        self._servers = []
+
+    async def _serve(self, device: SimulatedRobovac, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = asyncio.ensure_future(self._handle_connection(device, reader, writer))
+        self._connections.add(connection)
+
+        try:
+            await connection
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(connection)
+
+    async def _handle_connection(self,
+                                 device: SimulatedRobovac,
+                                 reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter):
+        pusher = asyncio.ensure_future(self._push_status(device, writer)) if self.push_interval else None
+        received = bytearray()
+
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+
+                received += data
+                for packet in self._take_packets(received):
+                    if random.random() < self.drop_probability:
+                        return
+
+                    reply = self._handle(device, packet)
+                    if reply is not None:
+                        await self._write(writer, reply)
+
+                if len(received) > 4096:
+                    logging.warning('Simulated RoboVac dropping connection sending unparseable data')
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            if pusher is not None:
+                pusher.cancel()
+            writer.close()
+
+    @staticmethod
+    def _take_packets(received: bytearray) -> List[LocalServerInfo_pb2.LocalServerMessage]:
+        """ Remove every complete packet from the start of the received bytes. """
+        packets = []
+        blocks = 1
+
+        while blocks * crypto.BLOCK_SIZE <= len(received):
+            size = blocks * crypto.BLOCK_SIZE
+            packet = _parse_client_packet(crypto.decrypt(bytes(received[:size])))
+
+            if packet is None:
+                blocks += 1
+                continue
+
+            packets.append(packet)
+            del received[:size]
+            blocks = 1
+
+        return packets
+
+    def _handle(self, device: SimulatedRobovac, packet) -> Optional[LocalServerInfo_pb2.LocalServerMessage]:
+        """ Apply a packet to the simulated RoboVac, returning the reply to send, if any. """
+        if packet.localcode != device.local_code:
+            raise ConnectionResetError('Local code rejected')
+
+        reply = LocalServerInfo_pb2.LocalServerMessage()
+        reply.localcode = device.local_code
+        payload = packet.WhichOneof('playload')
+
+        if payload == 'a':
+            device.pings_received += 1
+            reply.magic_num = device.magic_number
+            reply.a.type = _PING_RESPONSE
+            return reply
+
+        if self.strict_magic_numbers and packet.magic_num != device.magic_number + 1:
+            return None
+
+        device.magic_number = packet.magic_num
+
+        if payload != 'c':
+            return None
+
+        if packet.c.type == _UserDataMessage.sendUsrDataToDev:
+            device.handle_command(packet.c.usr_data)
+            return None
+
+        if packet.c.type == _UserDataMessage.getDevStatusData:
+            device.status_requests_received += 1
+            reply.magic_num = packet.magic_num
+            reply.c.type = _UserDataMessage.getDevStatusData
+            reply.c.usr_data = device.status_bytes()
+            return reply
+
+        return None
+
+    async def _write(self, writer: asyncio.StreamWriter, message: LocalServerInfo_pb2.LocalServerMessage):
+        latency = random.uniform(*self.latency) if isinstance(self.latency, tuple) else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+
+        data = _encrypt_frame(message)
+        chunk_size = self.split_size or len(data)
+
+        for offset in range(0, len(data), chunk_size):
+            writer.write(data[offset:offset + chunk_size])
+            await writer.drain()
+
+    async def _push_status(self, device: SimulatedRobovac, writer: asyncio.StreamWriter):
+        while True:
+            await asyncio.sleep(self.push_interval)
+
+            push = LocalServerInfo_pb2.LocalServerMessage()
+            push.localcode = device.local_code
+            push.magic_num = device.magic_number
+            push.c.type = _UserDataMessage.sendStausDataToApp
+            push.c.usr_data = device.status_bytes()
+
+            await self._write(writer, push)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve simulated RoboVacs for testing and benchmarking.')
+    parser.add_argument('--count', type=int, default=1, help='Number of simulated RoboVacs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--base-port', type=int, default=55556, help='Port of the first RoboVac')
+    parser.add_argument('--subnet', help='Serve one RoboVac on port 55556 of every address in this subnet instead, '
+                                         'e.g. 127.0.1.0/24')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before every reply')
+    parser.add_argument('--split-size', type=int, help='Write replies in chunks of at most this many bytes')
+    parser.add_argument('--drop-probability', type=float, default=0.0)
+    parser.add_argument('--push-interval', type=float, help='Seconds between pushed status updates')
+    parser.add_argument('--time-scale', type=float, default=1.0)
+    parser.add_argument('--cloud-port', type=int, help='Also serve a stand-in for the Eufy cloud API on this port, '
+                                                       'listing every simulated RoboVac')
+    args = parser.parse_args()
+
+    simulator = RobovacSimulator(latency=args.latency,
+                                 split_size=args.split_size,
+                                 drop_probability=args.drop_probability,
+                                 push_interval=args.push_interval,
+                                 time_scale=args.time_scale)
+
+    if args.subnet:
+        starting = simulator.start_on_hosts(str(host) for host in ipaddress.ip_network(args.subnet).hosts())
+    else:
+        starting = simulator.start(args.count, args.host, args.base_port)
+
+    loop = asyncio.get_event_loop()
+    devices = loop.run_until_complete(starting)
+    for host, port, local_code in devices:
+        print(f'{host}:{port} {local_code}', flush=True)
+
+    if args.cloud_port is not None:
+        cloud = EufyCloudSimulator((host, local_code) for host, port, local_code in devices)
+        print(f'Eufy cloud API: {cloud.start(args.host, args.cloud_port)}', flush=True)
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        loop.run_until_complete(simulator.stop())
+
+
+if __name__ == '__main__':
+    main()
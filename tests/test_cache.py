@@ -0,0 +1,48 @@
+""" StatusCache coalescing and invalidation, with fetches held open by events. """
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from robovac.cache import StatusCache
+
+
+def slow_fetch(started: threading.Event, release: threading.Event, status: str):
+    def fetch():
+        started.set()
+        release.wait(5)
+        return status
+
+    return fetch
+
+
+def test_concurrent_callers_share_a_fetch():
+    cache = StatusCache(ttl=60)
+    started, release = threading.Event(), threading.Event()
+
+    with ThreadPoolExecutor(2) as executor:
+        first = executor.submit(cache.get, slow_fetch(started, release, 'status'))
+        started.wait(5)
+        second = executor.submit(cache.get, lambda: 'unused')
+        release.set()
+
+        assert first.result(5) == second.result(5) == 'status'
+
+    assert cache.stats() == {'hits': 0, 'misses': 1, 'coalesced': 1}
+
+
+def test_invalidate_stops_later_callers_joining_the_fetch_in_flight():
+    cache = StatusCache(ttl=60)
+    started, release = threading.Event(), threading.Event()
+
+    with ThreadPoolExecutor(1) as executor:
+        before = executor.submit(cache.get, slow_fetch(started, release, 'before'))
+        started.wait(5)
+        cache.invalidate()
+
+        after = cache.get(lambda: 'after')
+        release.set()
+
+        assert before.result(5) == 'before'
+        assert after == 'after'
+
+    # The fetch started before invalidating must neither be cached nor clear the newer entry
+    assert cache.get(lambda: 'refetched') == 'after'
@@ -0,0 +1,97 @@
+""" EufyCloudClient against the local stand-in for the Eufy cloud API. """
+import pytest
+
+from robovac.cloud import EufyApiError, EufyCloudClient, normalise_mac
+from robovac.cloud_simulator import EufyCloudSimulator
+
+DEVICES = [('192.168.1.10', 'LOCALCODE0000000'), ('192.168.1.11', 'LOCALCODE1111111')]
+
+
+@pytest.fixture
+def served_cloud():
+    simulator = EufyCloudSimulator(DEVICES)
+    yield simulator, simulator.start()
+    simulator.stop()
+
+
+@pytest.fixture
+def cloud(served_cloud):
+    return served_cloud[0]
+
+
+@pytest.fixture
+def base_url(served_cloud):
+    return served_cloud[1]
+
+
+@pytest.fixture
+def client(cloud, base_url):
+    with EufyCloudClient(cloud.username, cloud.password, base_url=base_url) as client:
+        yield client
+
+
+def test_token_is_reused(cloud, client):
+    client.devices()
+    client.devices(refresh=True)
+
+    assert cloud.logins == 1
+    assert cloud.device_listings == 2
+
+
+def test_logs_in_again_after_a_401(cloud, client):
+    client.devices()
+    # The next listing is refused although the client's token has not expired
+    cloud.revoke_tokens()
+
+    client.devices(refresh=True)
+
+    assert cloud.logins == 2
+    assert cloud.device_listings == 2
+
+
+def test_wrong_password_raises(cloud, base_url):
+    with EufyCloudClient(cloud.username, 'wrong', base_url=base_url) as client:
+        with pytest.raises(EufyApiError):
+            client.devices()
+
+
+def test_get_local_codes_uses_a_single_listing(cloud, client):
+    local_codes = client.get_local_codes(ip for ip, _ in DEVICES)
+
+    assert local_codes == dict(DEVICES)
+    assert cloud.device_listings == 1
+
+
+def test_get_local_code(cloud, client):
+    assert client.get_local_code('192.168.1.11') == 'LOCALCODE1111111'
+    assert client.get_local_code('192.168.1.10') == 'LOCALCODE0000000'
+    assert cloud.device_listings == 1
+
+
+@pytest.mark.parametrize('mac', ['02:ab:cd:ef:00:01', '02-ab-cd-ef-00-01', '02abcdef0001', '02:AB:CD:EF:00:01'])
+def test_find_device_by_differently_formatted_mac(client, mac):
+    assert client.find_device(mac=mac).local_code == 'LOCALCODE1111111'
+
+
+def test_normalise_mac():
+    assert normalise_mac('AA-BB-CC-DD-EE-FF') == 'aa:bb:cc:dd:ee:ff'
+    assert normalise_mac('aabb.ccdd.eeff') == 'aa:bb:cc:dd:ee:ff'
+    assert normalise_mac('AA:BB:CC:DD:EE:FF') == 'aa:bb:cc:dd:ee:ff'
+
+
+def test_missed_lookup_refreshes_once(cloud, client):
+    client.devices()
+
+    with pytest.raises(EufyApiError):
+        client.get_local_code('192.168.1.99')
+
+    assert cloud.device_listings == 2
+
+
+def test_missed_lookup_finds_a_new_device(cloud, client):
+    client.devices()
+    cloud.devices.append(('192.168.1.12', 'LOCALCODE2222222'))
+
+    assert client.get_local_code('192.168.1.12') == 'LOCALCODE2222222'
+    assert client.get_local_code('192.168.1.10') == 'LOCALCODE0000000'
+    assert cloud.device_listings == 2
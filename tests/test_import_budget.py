@@ -0,0 +1,20 @@
+"""
+Enforces the import time budgets of benchmarks/bench_import.py. Set ROBOVAC_IMPORT_BUDGET_SCALE to scale every budget
+up on slower machines.
+"""
+import os
+
+import pytest
+
+from benchmarks.bench_import import SCENARIOS, measure
+
+RUNS = 5
+BUDGET_SCALE = float(os.environ.get('ROBOVAC_IMPORT_BUDGET_SCALE', '1.0'))
+
+
+@pytest.mark.parametrize('statement, budget, forbidden_modules', SCENARIOS, ids=[scenario[0] for scenario in SCENARIOS])
+def test_import_budget(statement, budget, forbidden_modules):
+    milliseconds, loaded = measure(statement, forbidden_modules, RUNS)
+
+    assert loaded == [], f'{statement} loaded {", ".join(loaded)}'
+    assert milliseconds <= budget * BUDGET_SCALE, f'{statement} took {milliseconds:.2f} ms'
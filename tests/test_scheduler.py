@@ -0,0 +1,99 @@
+""" CommandScheduler against a stand-in Robovac which records the commands sent. """
+import threading
+import time
+
+import pytest
+
+from robovac.metrics import MetricsRegistry
+from robovac.scheduler import COMMANDS, CommandScheduler
+
+
+class FakeRobovac:
+    """ Records every command, and holds the first send until released so the queue can build up behind it. """
+
+    ip = '192.168.1.10'
+
+    def __init__(self):
+        self.metrics = MetricsRegistry()
+        self.sent = []
+        self.release = threading.Event()
+
+    def _send_command(self, mode, command):
+        self.release.wait(5)
+        self.sent.append((mode, command))
+
+    def get_status(self):
+        self.release.wait(5)
+
+
+@pytest.fixture
+def robovac():
+    return FakeRobovac()
+
+
+@pytest.fixture
+def scheduler(robovac):
+    scheduler = CommandScheduler(robovac, rate=1000.0, burst=1000)
+    yield scheduler
+    robovac.release.set()
+    scheduler.close()
+
+
+def wait_until_sending(scheduler):
+    """ Submit a status request and wait until the background thread is blocked sending it. """
+    future = scheduler.get_status()
+    for _ in range(500):
+        if future.running():
+            return
+        time.sleep(0.01)
+    raise AssertionError('The scheduler never started sending')
+
+
+def test_stop_merged_into_a_queued_stop_discards_movement(robovac, scheduler):
+    wait_until_sending(scheduler)
+    scheduler.submit('stop')
+    movement = scheduler.submit('go_forward')
+    scheduler.submit('stop')
+
+    robovac.release.set()
+    scheduler.close()
+
+    assert movement.cancelled()
+    assert robovac.sent == [COMMANDS['stop']]
+
+
+def test_urgent_commands_overtake_movement(robovac, scheduler):
+    wait_until_sending(scheduler)
+    scheduler.submit('go_forward')
+    scheduler.submit('start_auto_clean')
+    scheduler.submit('go_home')
+
+    robovac.release.set()
+    scheduler.close()
+
+    assert robovac.sent == [COMMANDS['go_home'], COMMANDS['start_auto_clean']]
+    assert scheduler.stats()['preempted'] == 1
+
+
+def test_repeated_movement_is_never_collapsed(robovac, scheduler):
+    wait_until_sending(scheduler)
+    for _ in range(3):
+        scheduler.submit('go_forward')
+
+    robovac.release.set()
+    scheduler.close()
+
+    assert robovac.sent == [COMMANDS['go_forward']] * 3
+    assert scheduler.stats()['collapsed'] == 0
+
+
+def test_settings_are_collapsed(robovac, scheduler):
+    wait_until_sending(scheduler)
+    first = scheduler.submit('use_max_speed')
+    second = scheduler.submit('use_normal_speed')
+
+    robovac.release.set()
+    scheduler.close()
+
+    assert first is second
+    assert robovac.sent == [COMMANDS['use_normal_speed']]